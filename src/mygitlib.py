@@ -1,84 +1,144 @@
-import argparse
-import collections
-import configparser
-from datetime import datetime
-import grp, pwd
-from fnmatch import fnmatch
-import hashlib
+# Only the cheap modules are imported here, every command runs a new python
+# process so startup time matters.  The heavy ones (argparse, configparser,
+# hashlib, zlib, datetime...) are imported by the functions using them.
 from math import ceil
 import os
-import re       # regex
 import sys      # need this in order to access command-line arguments (in sys.argv)
-import zlib     # git compresses everything using zib
 
 
 # Global vars
 # ------------------------------------------------------------------------------------
 
-# ArgumentParser instance
-argparser = argparse.ArgumentParser(description="A random description...")
+# Each command is registered by a function adding its arguments to its
+# subparser.  Building every subparser costs more than most commands, so
+# argparser_build() only registers the one which is going to run.
 
-# This line allows us to add commands when we call the script
-argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
 
-# Is mandatory to specify at least a command, for instance when we call
-# git we need to give at least one command, we don't write only 'git'
-argsubparsers.required = True  
+def argparser_init(argsp):
 
+    # Add the value 'path' for the argument 'init'
+    argsp.add_argument("path", metavar="directory", nargs="?", default=".", help="Where to create the repository.")
 
 
+def argparser_cat_file(argsp):
 
-# Add 'init' command 
-argsp = argsubparsers.add_parser("init", help="Initialize a new, empty repository.")
+    # Add the value 'type' for the argument 'cat-file'
+    argsp.add_argument("type", metavar="type", choices=["blob", "commit", "tag", "tree"], help="Specify the type")
 
-# Add the value 'path' for the argument 'init'
-argsp.add_argument("path", metavar="directory", nargs="?", default=".", help="Where to create the repository.")
+    # Add the value 'object' (a SHA1 hex string) for the argument 'cat-file', SHA1
+    argsp.add_argument("object", metavar="object", help="The object to display")
 
 
+def argparser_hash_object(argsp):
 
+    argsp.add_argument("-t", metavar="type", dest="type", choices=["blob", "commit", "tag", "tree"], default="blob", help="Specify the type")
 
-# Add 'cat-file' command
-argsp = argsubparsers.add_parser("cat-file", help="Provide content of repository objects")
+    argsp.add_argument("-w", dest="write", action="store_true", help="Actually write the object into the database")
 
-# Add the value 'type' for the argument 'cat-file'
-argsp.add_argument("type", metavar="type", choices=["blob", "commit", "tag", "tree"], help="Specify the type")
+    argsp.add_argument("path", help="Read object from <file>")
 
-# Add the value 'object' (a SHA1 hex string) for the argument 'cat-file', SHA1
-argsp.add_argument("object", metavar="object", help="The object to display")
 
+def argparser_log(argsp):
 
+    argsp.add_argument("commit", default="HEAD", nargs="?", help="Commit to start at.")
 
 
-argsp = argsubparsers.add_parser("hash-object", help="Compute object ID and optionally creates a blob from a file")
+def argparser_ls_tree(argsp):
 
-argsp.add_argument("-t", metavar="type", dest="type", choices=["blob", "commit", "tag", "tree"], default="blob", help="Specify the type")
+    argsp.add_argument("-r", dest="recursive", action="store_true", help="Recurse into sub-trees")
 
-argsp.add_argument("-w", dest="write", action="store_true", help="Actually write the object into the database")
+    argsp.add_argument("tree", help="A tree-ish object.")
 
-argsp.add_argument("path", help="Read object from <file>")
 
+def argparser_checkout(argsp):
 
+    argsp.add_argument("commit", help="The commit or tree to checkout.")
 
+    argsp.add_argument("path", help="The EMPTY directory to checkout on.")
 
-argsp = argsubparsers.add_parser("log", help="Display history of a given commit.")
 
-argsp.add_argument("commit", default="HEAD", nargs="?", help="Commit to start at.")
+def argparser_write_tree(argsp):
+    pass
 
 
+def argparser_commit(argsp):
 
-argsp = argsubparsers.add_parser("ls-tree", help="Pretty-print a tree object.")
+    argsp.add_argument("-m", metavar="message", dest="message", required=True, help="Message to associate with this commit.")
 
-argsp.add_argument("-r", dest="recursive", action="store_true", help="Recurse into sub-trees")
 
-argsp.add_argument("tree", help="A tree-ish object.")
+def argparser_clone(argsp):
 
+    argsp.add_argument("--shared", action="store_true", help="Borrow the objects of the source repository through alternates instead of linking them")
 
+    argsp.add_argument("repository", help="Path of the repository to clone.")
 
-argsp = argsubparsers.add_parser("checkout", help="Checkout a commit inside of a directory.")
+    argsp.add_argument("directory", help="Where to create the new repository.")
 
-argsp.add_argument("commit", help="The commit or tree to checkout.")
 
-argsp.add_argument("path", help="The EMPTY directory to checkout on.")
+def argparser_write_bitmap(argsp):
+    pass
+
+
+def argparser_rev_list(argsp):
+
+    argsp.add_argument("--objects", action="store_true", help="List trees and blobs too, after the commits")
+
+    argsp.add_argument("--count", action="store_true", help="Print the number of objects instead of listing them")
+
+    argsp.add_argument("commit", nargs="*", default=["HEAD"], help="Commits to start at.")
+
+
+def argparser_rev_parse(argsp):
+
+    argsp.add_argument("name", help="The name to parse")
+
+
+# Command name -> (help, function adding its arguments)
+commands = {
+    "init"          : ("Initialize a new, empty repository.", argparser_init),
+    "cat-file"      : ("Provide content of repository objects", argparser_cat_file),
+    "hash-object"   : ("Compute object ID and optionally creates a blob from a file", argparser_hash_object),
+    "log"           : ("Display history of a given commit.", argparser_log),
+    "ls-tree"       : ("Pretty-print a tree object.", argparser_ls_tree),
+    "checkout"      : ("Checkout a commit inside of a directory.", argparser_checkout),
+    "write-tree"    : ("Create a tree object from the current index.", argparser_write_tree),
+    "commit"        : ("Record changes to the repository.", argparser_commit),
+    "clone"         : ("Clone a local repository into a new directory.", argparser_clone),
+    "write-bitmap"  : ("Write reachability bitmaps for every ref.", argparser_write_bitmap),
+    "rev-list"      : ("List the objects reachable from the given commits, newest first.", argparser_rev_list),
+    "rev-parse"     : ("Parse revision (or other objects) identifiers", argparser_rev_parse),
+}
+
+# Inflated objects of every repository, see object_cache_get()
+object_cache = None
+
+
+def argparser_build(argv):
+
+    import argparse
+
+    # ArgumentParser instance
+    argparser = argparse.ArgumentParser(description="A random description...")
+
+    # This line allows us to add commands when we call the script
+    argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
+
+    # Is mandatory to specify at least a command, for instance when we call
+    # git we need to give at least one command, we don't write only 'git'
+    argsubparsers.required = True
+
+    # Without a known command (--help, a typo...) argparse needs all of
+    # them to print its message
+    if argv and argv[0] in commands:
+        names = [ argv[0] ]
+    else:
+        names = commands.keys()
+
+    for name in names:
+        help, add_arguments = commands[name]
+        add_arguments(argsubparsers.add_parser(name, help=help))
+
+    return argparser
 
 
 # ------------------------------------------------------------------------------------
@@ -86,39 +146,203 @@ argsp.add_argument("path", help="The EMPTY directory to checkout on.")
 
 def main(argv=sys.argv[1:]):
 
-    args = argparser.parse_args(argv)
+    args = argparser_build(argv).parse_args(argv)
 
     match args.command:
         case "add"          : cmd_add(args)
         case "cat-file"     : cmd_cat_file(args)
         case "check-ignore" : cmd_check_ignore(args)
         case "checkout"     : cmd_checkout(args)
+        case "clone"        : cmd_clone(args)
         case "commit"       : cmd_commit(args)
         case "hash-object"  : cmd_hash_object(args)
         case "init"         : cmd_init(args)
         case "log"          : cmd_log(args)
         case "ls-files"     : cmd_ls_files(args)
         case "ls-tree"      : cmd_ls_tree(args)
+        case "rev-list"     : cmd_rev_list(args)
         case "rev-parse"    : cmd_rev_parse(args)
         case "rm"           : cmd_rm(args)
         case "show-ref"     : cmd_show_ref(args)
         case "status"       : cmd_status(args)
         case "tag"          : cmd_tag(args)
+        case "write-bitmap" : cmd_write_bitmap(args)
+        case "write-tree"   : cmd_write_tree(args)
         case _              : print("Bad command.")
 
 
 
+# -----------------------------------------------------------------------------------------
+# Begin tracing
+
+
+# MYGIT_TRACE=1 (or 2, or true, like GIT_TRACE) writes a JSON-lines trace
+# on stderr when the command exits, MYGIT_TRACE=/some/file appends it to
+# that file and MYGIT_TRACE=/some/dir writes one file per process in that
+# directory.  Like GIT_TRACE, only an absolute path is a file: commands run
+# from anywhere, a relative one would leave files in every worktree.  With
+# MYGIT_TRACE_FORMAT=chrome the trace is in Chrome's trace event format
+# instead (open it with chrome://tracing or Perfetto), a single JSON
+# document: a file is overwritten rather than appended to.
+TRACE = os.environ.get("MYGIT_TRACE", "").lower() not in ("", "0", "false", "no")
+
+# File operations counted as syscalls, among the audit events (see sys.addaudithook)
+TRACE_SYSCALLS = { "open", "os.listdir", "os.scandir", "os.mkdir", "os.rename", "os.link",
+                   "os.remove", "os.rmdir", "os.chmod", "os.utime", "shutil.copyfile" }
+
+trace_spans = list()                        # (name, thread, start ns, duration ns, depth)
+trace_counters = None                       # name -> value, a collections.Counter
+trace_local = None                          # .stack, the traced functions running in this thread, a threading.local
+trace_lock = None                           # Held to update trace_counters, AsyncRepository reads from several threads
+
+
+def traced(fn):
+    """Record a span for every call of fn when tracing is on.
+
+When it's off fn is returned as is, so it costs nothing.  Recursive
+calls are part of the outermost span, they don't get their own."""
+
+    if not TRACE:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+
+        stack = trace_local.__dict__.setdefault("stack", list())
+
+        if fn in stack:
+            return fn(*args, **kwargs)
+
+        stack.append(fn)
+        start = time.perf_counter_ns()
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            trace_spans.append((fn.__name__, threading.get_ident(), start, time.perf_counter_ns() - start, len(stack) - 1))
+            stack.pop()
+
+    return wrapper
+
+
+def trace_count(name, n=1):
+    with trace_lock:
+        trace_counters[name] += n
+
+
+def trace_inflate(data):
+
+    start = time.perf_counter_ns()
+    raw = zlib.decompress(data)
+
+    with trace_lock:
+        trace_counters["inflate_ns"] += time.perf_counter_ns() - start
+        trace_counters["bytes_inflated"] += len(raw)
+
+    return raw
+
+
+def trace_deflate(data):
+
+    start = time.perf_counter_ns()
+    raw = zlib.compress(data)
+
+    with trace_lock:
+        trace_counters["deflate_ns"] += time.perf_counter_ns() - start
+        trace_counters["bytes_deflated"] += len(data)
+
+    return raw
+
+
+def trace_audit(event, args):
+    if event in TRACE_SYSCALLS:
+        with trace_lock:
+            trace_counters["syscall." + event] += 1
+
+
+def trace_flush():
+
+    # perf_counter_ns() has no fixed origin, move the spans to unix time
+    epoch = time.time_ns() - time.perf_counter_ns()
+    pid = os.getpid()
+
+    with trace_lock:
+        counters = dict(trace_counters)
+
+    if os.environ.get("MYGIT_TRACE_FORMAT", "").lower() == "chrome":
+
+        events = [ { "name": name, "cat": "mygit", "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (epoch + start) / 1000, "dur": dur / 1000 }
+                   for name, tid, start, dur, depth in trace_spans ]
+
+        events.append({ "name": "counters", "ph": "C", "pid": pid, "tid": pid,
+                        "ts": time.time_ns() / 1000, "args": counters })
+
+        out = json.dumps({ "traceEvents": events, "otherData": { "argv": sys.argv } })
+        ext = "json"
+        mode = "w"   # Two JSON documents in a row aren't a trace anymore
+    else:
+        lines = [ json.dumps({ "event": "span", "name": name, "pid": pid, "tid": tid,
+                               "start_us": (epoch + start) // 1000, "dur_us": dur / 1000, "depth": depth })
+                  for name, tid, start, dur, depth in trace_spans ]
+
+        lines.append(json.dumps({ "event": "counters", "pid": pid, "argv": sys.argv, "counters": counters }))
+
+        out = "\n".join(lines) + "\n"
+        ext = "jsonl"
+        mode = "a"
+
+    dest = os.environ["MYGIT_TRACE"]
+
+    if dest.lower() in ("1", "2", "true", "yes"):
+        sys.stderr.write(out)
+        return
+
+    if not os.path.isabs(dest):
+        sys.stderr.write("warning: unknown MYGIT_TRACE value {0!r}, set it to an absolute path to trace into a file\n".format(dest))
+        return
+
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, "mygit-{0}-{1}.{2}".format(int(time.time()), pid, ext))
+
+    with open(dest, mode) as f:
+        f.write(out)
+
+
+if TRACE:
+    import atexit
+    import collections
+    import functools
+    import json
+    import threading
+    import time
+    import zlib
+    trace_counters = collections.Counter()
+    trace_local = threading.local()
+    trace_lock = threading.Lock()
+    sys.addaudithook(trace_audit)
+    atexit.register(trace_flush)
+
+
+# End tracing
+# -----------------------------------------------------------------------------------------
+
+
+
 # -----------------------------------------------------------------------------------------
 # Begin bridge functions
 
 
+@traced
 def cmd_init(args):
     repo_create(args.path)
 
+@traced
 def cmd_cat_file(args):
     repo = repo_find()
     cat_file(repo, args.object, fmt=args.type.encode())
 
+@traced
 def cmd_hash_object(args):
     
     if args.write:
@@ -131,6 +355,7 @@ def cmd_hash_object(args):
         print(sha)
 
 
+@traced
 def cmd_log(args):
 
     repo = repo_find()
@@ -143,11 +368,13 @@ def cmd_log(args):
     print("}")
 
 
+@traced
 def cmd_ls_tree(args):
     repo = repo_find()
     ls_tree(repo, args.tree, args.recursive)
 
 
+@traced
 def cmd_checkout(args):
 
     repo = repo_find()
@@ -171,6 +398,110 @@ def cmd_checkout(args):
     tree_checkout(repo, obj, os.path.realpath(args.path))
 
 
+@traced
+def cmd_write_tree(args):
+
+    repo = repo_find()
+    index = index_read(repo)
+
+    # If the root of the cache-tree is valid the index didn't change since
+    # the last write-tree/commit, so there is nothing to write back
+    clean = index.cache_tree.sha != None
+
+    print(tree_from_index(repo, index))
+
+    if not clean:
+        index_write(repo, index)
+
+
+@traced
+def cmd_commit(args):
+
+    from datetime import datetime
+
+    repo = repo_find()
+
+    author = gitconfig_user_get(gitconfig_read(repo))
+
+    if author == None:
+        raise Exception("Please set user.name and user.email in your git config")
+
+    index = index_read(repo)
+
+    clean = index.cache_tree.sha != None
+
+    # Only the directories invalidated since the last commit are rewritten
+    tree = tree_from_index(repo, index)
+
+    if not clean:
+        index_write(repo, index)
+
+    parent = ref_resolve(repo, "HEAD")
+
+    # Nothing staged since HEAD, git refuses to make an empty commit too
+    if parent and object_read(repo, parent).commit[b'tree'].decode("ascii") == tree:
+        raise Exception("Nothing to commit, the index matches HEAD")
+
+    commit = commit_create(repo, tree, parent, author, datetime.now(), args.message)
+
+    # Update HEAD so our commit is now the tip of the active branch, unless
+    # another commit got there first: ours would drop it from the history
+    active_branch = branch_get_active(repo)
+
+    if active_branch:
+        ref_write(repo, "refs/heads/" + active_branch, commit, old=parent)
+    else:
+        # Detached HEAD
+        ref_write(repo, "HEAD", commit, old=parent)
+
+    print(commit)
+
+
+@traced
+def cmd_clone(args):
+    repo_clone(args.repository, args.directory, shared=args.shared)
+
+
+@traced
+def cmd_write_bitmap(args):
+
+    repo = repo_find()
+
+    # Every branch and tag, and HEAD in case it's detached
+    tips = list(ref_list(repo).values())
+    head = ref_resolve(repo, "HEAD")
+
+    if head:
+        tips.append(head)
+
+    bitmap = bitmap_write(repo, tips)
+
+    print("{0} objects, {1} bitmaps".format(len(bitmap.table), len(bitmap.commits)))
+
+
+@traced
+def cmd_rev_parse(args):
+    repo = repo_find()
+    print(object_find(repo, args.name))
+
+
+@traced
+def cmd_rev_list(args):
+
+    repo = repo_find()
+
+    tips = [object_find(repo, name) for name in args.commit]
+    fmt = None if args.objects else b'commit'
+
+    if args.count:
+        print(reachable_count(repo, tips, fmt=fmt))
+        return
+
+    for sha, obj_fmt in reachable_objects(repo, tips).items():
+        if fmt == None or obj_fmt == fmt:
+            print(sha)
+
+
 # End bridge functions
 # -----------------------------------------------------------------------------------------
 
@@ -185,6 +516,7 @@ class GitRepository (object):
     worktree = None     # path of the effective working directory
     gitdir = None       # .git dir path, (it is located in the root of the working directory)
     conf = None         # .ini file path for config
+    alternates = None   # other objects dirs we can read from, see repo_alternates()
 
     def __init__(self, path, force=False):
         
@@ -196,6 +528,8 @@ class GitRepository (object):
 
         # --- Read configuration file in .git/config ---
 
+        import configparser
+
         # self.conf is now an instance of the class ConfigParser        
         self.conf = configparser.ConfigParser()
 
@@ -257,6 +591,12 @@ class GitCommit (GitObject):
         self.commit = dict()
 
 
+class GitTag (GitCommit):
+
+    # Same format as a commit: object, type, tag and tagger, then the message
+    fmt = b'tag'
+
+
 class GitTreeLeaf (object):
 
     def __init__(self, mode, path, sha):
@@ -277,6 +617,143 @@ class GitTree(GitObject):
         self.items = list()
 
 
+class GitIndexEntry (object):
+
+    def __init__(self, ctime=None, mtime=None, dev=None, ino=None,
+                 mode_type=None, mode_perms=None, uid=None, gid=None,
+                 fsize=None, sha=None, flag_assume_valid=None,
+                 flag_stage=None, name=None):
+
+        self.ctime = ctime                          # (seconds, nanoseconds) of the last metadata change
+        self.mtime = mtime                          # (seconds, nanoseconds) of the last data change
+        self.dev = dev                              # ID of the device containing this file
+        self.ino = ino                              # file's inode number
+        self.mode_type = mode_type                  # 0b1000 (regular), 0b1010 (symlink), 0b1110 (gitlink)
+        self.mode_perms = mode_perms                # permissions, an integer
+        self.uid = uid                              # user ID of the owner
+        self.gid = gid                              # group ID of the owner
+        self.fsize = fsize                          # size of this object, in bytes
+        self.sha = sha                              # the object's SHA1 hex string
+        self.flag_assume_valid = flag_assume_valid
+        self.flag_stage = flag_stage
+        self.name = name                            # full path of the object, relative to the worktree
+
+
+class GitCacheTree (object):
+    """A node of the cached-tree ("TREE") index extension.
+
+Each node remembers the SHA of the tree object built for one directory
+of the index and how many index entries that tree covers, so that
+write-tree can reuse it instead of rebuilding the directory.  A node is
+invalid (sha is None, entry_count is -1) when something below it changed."""
+
+    def __init__(self, name="", entry_count=-1, sha=None):
+        self.name = name                            # directory name, "" for the root
+        self.entry_count = entry_count              # index entries covered by this tree, -1 if invalid
+        self.sha = sha                              # tree SHA1 hex string, None if invalid
+        self.subtrees = dict()                      # name -> GitCacheTree
+
+    def invalidate(self):
+        self.entry_count = -1
+        self.sha = None
+
+
+class GitIndex (object):
+
+    version = None
+    entries = []
+    cache_tree = None
+
+    def __init__(self, version=2, entries=None, cache_tree=None):
+
+        if not entries:
+            entries = list()
+
+        if not cache_tree:
+            cache_tree = GitCacheTree()
+
+        self.version = version
+        self.entries = entries
+        self.cache_tree = cache_tree
+
+
+class GitObjectCache (object):
+    """Least recently used objects, inflated, as (fmt, data), by
+(objects directory, SHA).
+
+One cache is shared by every repository (and thread) of the process.
+The same SHA is the same content everywhere, but a repository must not
+see objects it doesn't have, so each one only finds its own, see
+object_cache_key().  Its size is bounded by max_bytes of object data."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+
+        # threading.Lock is _thread.allocate_lock, without importing all
+        # of threading on every command
+        import _thread, collections
+
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = collections.OrderedDict()  # key -> (fmt, data), least recently used first
+        self.lock = _thread.allocate_lock()
+
+    def get(self, key):
+
+        with self.lock:
+            item = self.items.get(key)
+            if item != None:
+                self.items.move_to_end(key)
+            return item
+
+    def put(self, key, fmt, data):
+
+        # A single big blob would flush everything else
+        if len(data) > self.max_bytes // 8:
+            return
+
+        with self.lock:
+
+            if key in self.items:
+                return
+
+            self.items[key] = (fmt, data)
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, (_, old) = self.items.popitem(last=False)
+                self.size -= len(old)
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class GitBitmapIndex (object):
+    """Reachability bitmaps over the object store.
+
+Every object known when the index was written gets a position in table,
+and a set of objects is a Python int with the bits of their positions
+set.  commits maps some selected commits to the set of every object
+reachable from them, so a walk can stop as soon as it meets one."""
+
+    def __init__(self, table=None, types=None, commits=None):
+
+        self.table = table if table != None else list()         # position -> object SHA
+        self.types = types if types != None else dict()         # fmt -> bits of the objects of that type
+        self.commits = commits if commits != None else dict()   # commit SHA -> bits of its reachable objects
+        self._positions = None
+
+    def positions(self):
+
+        # Built on first use, a query answered only by bitmaps never needs it
+        if self._positions == None:
+            self._positions = { sha: pos for pos, sha in enumerate(self.table) }
+
+        return self._positions
+
+
 # End classes
 # -----------------------------------------------------------------------------------------
 
@@ -360,6 +837,8 @@ def repo_create(path):
     
 def repo_default_config():
 
+    import configparser
+
     # ret is now an instance of the class ConfigParser
     ret = configparser.ConfigParser()
 
@@ -385,170 +864,404 @@ def repo_default_config():
     return ret 
     
 
-# Find the root of the current repository
-def repo_find(path=".", required=True):
+def repo_alternates(repo):
+    """Return the objects dirs listed in objects/info/alternates, following
+the alternates of the alternates too.  Read once per repository."""
 
-    # relative to absolute path
-    path = os.path.realpath(path)
+    if repo.alternates != None:
+        return repo.alternates
 
-    # if we are in the root (bacause we've found .git repo), return an instance of the class GitRepository
-    if os.path.isdir(os.path.join(path, ".git")):
-        return GitRepository(path)
+    # Built aside and assigned once complete, object_read() may run in
+    # several threads at the same time
+    alternates = list()
+    pending = [ repo_path(repo, "objects") ]
 
-    # If we haven't returned, recurse in parent, if w
-    parent = os.path.realpath(os.path.join(path, ".."))
+    while pending:
 
-    # If the parent is equals to path, we are already in the root dir, and .git is missing
-    if parent == path:
-        # Bottom case
-        # os.path.join("/", "..") == "/":
-        # If parent==path, then path is root.
-        if required:
-            raise Exception("No git directory.")
-        else:
-            return None
+        objects = pending.pop(0)
+        path = os.path.join(objects, "info", "alternates")
 
-    # Recursive case
-    return repo_find(parent, required)
+        if not os.path.isfile(path):
+            continue
 
-def object_read(repo, sha):
+        with open(path, "r") as f:
+            for line in f.read().splitlines():
 
-    path = repo_path(repo, "objects", sha[0:2], sha[2:])
+                line = line.strip()
 
-    if not os.path.isfile(path):
-        return None
+                if not line or line.startswith("#"):
+                    continue
 
-    with open(path, "rb") as f:
+                # Relative paths are relative to the objects dir listing them
+                alt = os.path.normpath(os.path.join(objects, line))
 
-        # every object is compressed with zlib
-        raw = zlib.decompress(f.read())
+                if not alt in alternates and alt != repo_path(repo, "objects"):
+                    alternates.append(alt)
+                    pending.append(alt)
 
-        x = raw.find(b' ')
-        fmt = raw[0:x]
+    repo.alternates = alternates
 
-        # Read and validate object size
-        y = raw.find(b'\x00', x)
-        size = int(raw[x:y].decode("ascii"))
+    return alternates
 
-        if size != len(raw)-y-1:
-            raise Exception("Malformed object {0}: bad length".format(sha))
 
-        # Pick constructor
-        match fmt:
-            case b'commit' : c=GitCommit
-            case b'tree'   : c=GitTree
-            case b'tag'    : c=GitTag
-            case b'blob'   : c=GitBlob
-            case _:
-                raise Exception("Unknown type {0} for object {1}".format(fmt.decode("ascii"), sha))
+@traced
+def repo_clone(src_path, path, shared=False):
 
-        # Call constructor and return object
-        return c(raw[y+1:])
+    src = GitRepository(os.path.realpath(src_path))
 
+    # Checked before anything is written: the checkout would overwrite
+    # files already there, or fail halfway on a directory
+    if os.path.exists(path):
 
-def object_write(obj, repo=None):
+        if not os.path.isdir(path):
+            raise Exception("Not a directory {0}!".format(path))
+        if os.listdir(path):
+            raise Exception("Not empty {0}!".format(path))
 
-    # Serialize object data
-    data = obj.serialize()
+    # Reopen it, repo_create() returns a repository without its config
+    repo = GitRepository(repo_create(path).worktree)
 
-    # Add header
-    result = obj.fmt + b' ' + str(len(data)).encode() + b'\x00' + data
+    src_objects = repo_path(src, "objects")
 
-    # Compute hash
-    sha = hashlib.sha1(result).hexdigest()
+    if shared:
+        # Nothing to copy, we read the source's objects directly
+        with open(repo_file(repo, "objects", "info", "alternates", mkdir=True), "w") as f:
+            f.write(src_objects + "\n")
+    else:
+        repo_clone_objects(src_objects, repo_path(repo, "objects"))
 
-    if repo:
-        # Compute path
-        path=repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
+    # Branches of the source become remote branches, tags are kept as they are
+    for ref, sha in ref_list(src).items():
+        if ref.startswith("refs/heads/"):
+            ref_write(repo, "refs/remotes/origin/" + ref[11:], sha)
+        else:
+            ref_write(repo, ref, sha)
 
-        if not os.path.exists(path):
-            with open(path, 'wb') as f:
-                # Compress and write
-                f.write(zlib.compress(result))
-    return sha
+    repo.conf.add_section('remote "origin"')
+    repo.conf.set('remote "origin"', "url", os.path.realpath(src_path))
+    repo.conf.set('remote "origin"', "fetch", "+refs/heads/*:refs/remotes/origin/*")
 
-def cat_file(repo, sha, fmt=None):
+    with open(repo_file(repo, "config"), "w") as f:
+        repo.conf.write(f)
 
-    obj = object_read(repo, object_find(repo, sha, fmt=fmt))
-    
-    if obj == None:
-        print("Not a valid object name: %s" % sha)
-        return
-        
-    sys.stdout.buffer.write(obj.serialize())
+    head = ref_resolve(src, "HEAD")
 
-# Temp function that has to be implemented. Now it returns just 'name' (SHA1 hex string)
-def object_find(repo, name, fmt=None, follow=True):
-    return name
+    # Empty source repository, nothing to checkout
+    if not head:
+        return repo
 
+    branch = branch_get_active(src)
 
-def object_hash(fd, fmt, repo=None):
-    """ Hash object, writing it to repo if provided."""
-    data = fd.read()
+    if branch:
+        ref_write(repo, "refs/heads/" + branch, head)
+        ref_write(repo, "HEAD", "ref: refs/heads/" + branch)
+    else:
+        ref_write(repo, "HEAD", head)
 
-    # Choose constructor according to fmt argument
-    match fmt:
-        case b'commit' : obj=GitCommit(data)
-        case b'tree'   : obj=GitTree(data)
-        case b'tag'    : obj=GitTag(data)
-        case b'blob'   : obj=GitBlob(data)
-        case _: raise Exception("Unknown type %s!" % fmt)
+    # Fill the worktree, and an index matching it
+    tree = object_read(repo, head).commit[b'tree'].decode("ascii")
+    tree_checkout(repo, object_read(repo, tree), repo.worktree)
 
-    return object_write(obj, repo)
+    index = GitIndex()
+    index.cache_tree.sha = tree
+    index.entries = index_from_tree(repo, tree, index.cache_tree)
+    index.entries.sort(key=lambda e: e.name.encode("utf8"))
+    index_write(repo, index)
 
+    return repo
 
 
-def commit_parse(raw, start=0, dct=None):
-    
-    if not dct:
-        dct = collections.OrderedDict()
+@traced
+def repo_clone_objects(src, dst):
 
-        # You CANNOT declare the argument as dct=OrderedDict() or all
-        # call to the functions will endlessly grow the same dict.
+    import shutil
 
-            # Not sure about that
+    # Loose objects are never modified once written, so both repositories
+    # can share the same files.  Hardlinks only work on the same
+    # filesystem, so fall back to copying the first time one fails
+    link = True
 
-    # We search for the next space and the next newline.
-    spc = raw.find(b' ', start)
-    nl = raw.find(b'\n', start)
+    for root, dirs, files in os.walk(src):
 
-    # If space appears before newline, we have a keyword.  Otherwise,
-    # it's the final message, which we just read to the end of the file.
+        dest_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(dest_root, exist_ok=True)
 
+        for name in files:
 
+            if name.endswith(".tmp"):
+                continue
 
-    # Base case
-    # =========
-    # If newline appears first (or there's no space at all, in which
-    # case find returns -1), we assume a blank line.  A blank line
-    # means the remainder of the data is the message.  We store it in
-    # the dictionary, with None as the key, and return.
+            source = os.path.join(root, name)
+            dest = os.path.join(dest_root, name)
 
-    if (spc < 0) or (nl < spc):
+            if link:
+                try:
+                    os.link(source, dest)
+                    continue
+                except OSError:
+                    link = False
 
-        assert nl == start
-        dct[None] = raw[start+1:]
-        return dct
+            shutil.copy2(source, dest)
 
-    # Recursive case
-    # ==============
-    # we read a key-value pair and recurse for the next.
-    key = raw[start:spc]
 
-    # Find the end of the value.  Continuation lines begin with a
-    # space, so we loop until we find a "\n" not followed by a space.
-    end = start
+# Find the root of the current repository
+@traced
+def repo_find(path=".", required=True):
+
+    # relative to absolute path.  Only once: every parent of a real path
+    # is a real path too, so we can walk up with dirname()
+    path = os.path.realpath(path)
 
     while True:
-        end = raw.find(b'\n', end+1)
-        if raw[end+1] != ord(' '): break
 
-    # Grab the value
-    # Also, drop the leading space on continuation lines
-    value = raw[spc+1:end].replace(b'\n ', b'\n')
+        # if we are in the root (bacause we've found .git repo), return an instance of the class GitRepository
+        if os.path.isdir(os.path.join(path, ".git")):
+            return GitRepository(path)
 
-    # Don't overwrite existing data contents
-    if key in dct:
+        # If we haven't returned, go on with the parent
+        parent = os.path.dirname(path)
+
+        # If the parent is equals to path, we are already in the root dir, and .git is missing
+        if parent == path:
+            # os.path.dirname("/") == "/":
+            # If parent==path, then path is root.
+            if required:
+                raise Exception("No git directory.")
+            else:
+                return None
+
+        path = parent
+
+def object_path(repo, sha):
+    """Path of the loose object sha, in this repository or one of its alternates, None if missing."""
+
+    path = repo_path(repo, "objects", sha[0:2], sha[2:])
+
+    if os.path.isfile(path):
+        return path
+
+    for objects in repo_alternates(repo):
+        path = os.path.join(objects, sha[0:2], sha[2:])
+        if os.path.isfile(path):
+            if TRACE:
+                trace_count("alternates_hits")
+            return path
+
+    return None
+
+
+@traced
+def object_read(repo, sha):
+
+    raw = object_read_raw(repo, sha)
+
+    if raw == None:
+        return None
+
+    return object_build(raw[0], raw[1], sha)
+
+
+def object_build(fmt, data, sha):
+
+    # Pick constructor
+    match fmt:
+        case b'commit' : c=GitCommit
+        case b'tree'   : c=GitTree
+        case b'tag'    : c=GitTag
+        case b'blob'   : c=GitBlob
+        case _:
+            raise Exception("Unknown type {0} for object {1}".format(fmt.decode("ascii"), sha))
+
+    # Call constructor and return object
+    return c(data)
+
+
+def object_read_raw(repo, sha):
+    """Return the type and the content of object sha, as (fmt, data), None if missing.
+
+Objects are inflated once, then served from the object cache."""
+
+    import zlib
+
+    cache = object_cache_get()
+    key = object_cache_key(repo, sha)
+    raw = cache.get(key)
+
+    if raw != None:
+        if TRACE:
+            trace_count("object_cache_hits")
+        return raw
+
+    path = object_path(repo, sha)
+
+    if not path:
+        return None
+
+    with open(path, "rb") as f:
+
+        # every object is compressed with zlib
+        raw = trace_inflate(f.read()) if TRACE else zlib.decompress(f.read())
+
+    if TRACE:
+        trace_count("objects_read")
+
+    x = raw.find(b' ')
+    fmt = raw[0:x]
+
+    # Read and validate object size
+    y = raw.find(b'\x00', x)
+    size = int(raw[x:y].decode("ascii"))
+
+    if size != len(raw)-y-1:
+        raise Exception("Malformed object {0}: bad length".format(sha))
+
+    data = raw[y+1:]
+    cache.put(key, fmt, data)
+
+    return fmt, data
+
+
+def object_cache_get():
+
+    # Created on first use, commands which never read an object don't
+    # pay for it
+    global object_cache
+
+    if object_cache == None:
+        object_cache = GitObjectCache()
+
+    return object_cache
+
+
+def object_cache_key(repo, sha):
+
+    # Objects found through an alternate are cached for the repository
+    # which borrows them, not for the alternate
+    return (repo_path(repo, "objects"), sha)
+
+
+@traced
+def object_write(obj, repo=None):
+
+    import hashlib, zlib
+
+    # Serialize object data
+    data = obj.serialize()
+
+    # Add header
+    result = obj.fmt + b' ' + str(len(data)).encode() + b'\x00' + data
+
+    # Compute hash
+    sha = hashlib.sha1(result).hexdigest()
+
+    # Objects borrowed from an alternate don't need to be written again
+    if repo and not object_path(repo, sha):
+        # Compute path
+        path=repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
+
+        with open(path, 'wb') as f:
+            # Compress and write
+            f.write(trace_deflate(result) if TRACE else zlib.compress(result))
+
+        if TRACE:
+            trace_count("objects_written")
+    return sha
+
+def cat_file(repo, sha, fmt=None):
+
+    obj = object_read(repo, object_find(repo, sha, fmt=fmt))
+    
+    if obj == None:
+        print("Not a valid object name: %s" % sha)
+        return
+        
+    sys.stdout.buffer.write(obj.serialize())
+
+# Temp function that has to be implemented. For now it only resolves HEAD,
+# refs, branch and tag names, anything else is returned as is (SHA1 hex string)
+def object_find(repo, name, fmt=None, follow=True):
+
+    if name == "HEAD" or name.startswith("refs/"):
+        candidates = [ name ]
+    else:
+        candidates = [ "refs/heads/" + name, "refs/tags/" + name ]
+
+    for ref in candidates:
+        sha = ref_resolve(repo, ref)
+        if sha:
+            return sha
+
+    return name
+
+
+def object_hash(fd, fmt, repo=None):
+    """ Hash object, writing it to repo if provided."""
+    data = fd.read()
+
+    # Choose constructor according to fmt argument
+    match fmt:
+        case b'commit' : obj=GitCommit(data)
+        case b'tree'   : obj=GitTree(data)
+        case b'tag'    : obj=GitTag(data)
+        case b'blob'   : obj=GitBlob(data)
+        case _: raise Exception("Unknown type %s!" % fmt)
+
+    return object_write(obj, repo)
+
+
+
+def commit_parse(raw, start=0, dct=None):
+    
+    if not dct:
+        import collections
+        dct = collections.OrderedDict()
+
+        # You CANNOT declare the argument as dct=OrderedDict() or all
+        # call to the functions will endlessly grow the same dict.
+
+            # Not sure about that
+
+    # We search for the next space and the next newline.
+    spc = raw.find(b' ', start)
+    nl = raw.find(b'\n', start)
+
+    # If space appears before newline, we have a keyword.  Otherwise,
+    # it's the final message, which we just read to the end of the file.
+
+
+
+    # Base case
+    # =========
+    # If newline appears first (or there's no space at all, in which
+    # case find returns -1), we assume a blank line.  A blank line
+    # means the remainder of the data is the message.  We store it in
+    # the dictionary, with None as the key, and return.
+
+    if (spc < 0) or (nl < spc):
+
+        assert nl == start
+        dct[None] = raw[start+1:]
+        return dct
+
+    # Recursive case
+    # ==============
+    # we read a key-value pair and recurse for the next.
+    key = raw[start:spc]
+
+    # Find the end of the value.  Continuation lines begin with a
+    # space, so we loop until we find a "\n" not followed by a space.
+    end = start
+
+    while True:
+        end = raw.find(b'\n', end+1)
+        if raw[end+1] != ord(' '): break
+
+    # Grab the value
+    # Also, drop the leading space on continuation lines
+    value = raw[spc+1:end].replace(b'\n ', b'\n')
+
+    # Don't overwrite existing data contents
+    if key in dct:
         if type(dct[key]) == list:
             dct[key].append(value)
         else:
@@ -560,7 +1273,9 @@ def commit_parse(raw, start=0, dct=None):
 
 def commit_serialize(commit):
 
-    ret = b''
+    # Collect the pieces and join them once at the end, repeated
+    # bytes concatenation copies the whole buffer every time
+    ret = list()
 
     # Output fields
     for k in commit.keys():
@@ -572,12 +1287,14 @@ def commit_serialize(commit):
             val = [ val ]
 
         for v in val:
-            ret += k + b' ' + (v.replace(b'\n', b'\n ')) + b'\n'
+            ret.append(k + b' ' + (v.replace(b'\n', b'\n ')) + b'\n')
 
-    # Append message
-    ret += b'\n' + commit[None] + b'\n'
+    # Append message.  commit_parse() keeps the message's trailing
+    # newline, so we don't add one: serialize(parse(raw)) == raw
+    ret.append(b'\n')
+    ret.append(commit[None])
 
-    return ret
+    return b''.join(ret)
 
 
 def log_graphviz(repo, sha, seen):
@@ -664,11 +1381,14 @@ def tree_parse(raw):
 # the leaf name, with an extra / if it's a directory.
 
 def tree_leaf_sort_key(leaf):
-    
-    if leaf.mode.startswith(b"10"):
-        return leaf.path
-    else:
+
+    # Only trees are directories: symlinks (120000) and submodules
+    # (160000) sort as plain names.  Tree modes are "40000", "040000" or,
+    # once parsed, " 40000"
+    if leaf.mode.lstrip(b" 0").startswith(b"4"):
         return leaf.path + "/"
+    else:
+        return leaf.path
 
 
 def tree_serialize(obj):
@@ -676,18 +1396,17 @@ def tree_serialize(obj):
     # This function sorts the tree object by the path of the leafs (read tree_leaf_sort_key() function)
     obj.items.sort(key=tree_leaf_sort_key)
     
-    ret = b''
+    ret = list()
     
     for i in obj.items:
         
-        ret += i.mode
-        ret += b' '
-        ret += i.path.encode("utf8")
-        ret += b'\x00'
-        sha = int(i.sha, 16)
-        ret += sha.to_bytes(20, byteorder="big")
+        ret.append(i.mode)
+        ret.append(b' ')
+        ret.append(i.path.encode("utf8"))
+        ret.append(b'\x00')
+        ret.append(bytes.fromhex(i.sha))
 
-    return ret
+    return b''.join(ret)
 
 
 
@@ -728,21 +1447,1149 @@ def ls_tree(repo, ref, recursive=None, prefix=""):
 def tree_checkout(repo, tree, path):
 
     for item in tree.items:
-        
-        obj = object_read(repo, item.sha)
+
         dest = os.path.join(path, item.path)
+        mode = int(item.mode.strip(), 8)
 
-        if obj.fmt == b'tree':
-            
-            os.mkdir(dest)
-            tree_checkout(repo, obj, dest)
-        
-        elif obj.fmt == b'blob':
-            
-            # @TODO Support symlinks (identified by mode 12****)
-            with open(dest, 'wb') as f:
-                f.write(obj.blobdata)
+        match tree_leaf_fmt(item):
 
+            case b'tree':
+                os.mkdir(dest)
+                tree_checkout(repo, object_read(repo, item.sha), dest)
 
-# End utilities
+            case b'commit':
+                # A submodule, git leaves an empty directory until it's cloned
+                os.mkdir(dest)
+
+            case b'blob' if mode >> 12 == 0b1010:
+                # A symlink, the blob is its target
+                os.symlink(object_read(repo, item.sha).blobdata, dest)
+
+            case b'blob':
+                with open(dest, 'wb') as f:
+                    f.write(object_read(repo, item.sha).blobdata)
+
+                # 100755, executable for whoever may read it
+                if mode & 0o100:
+                    st = os.stat(dest)
+                    os.chmod(dest, st.st_mode | (st.st_mode & 0o444) >> 2)
+
+
+@traced
+def index_read(repo):
+
+    import hashlib
+
+    index_file = repo_file(repo, "index")
+
+    # New repositories have no index!
+    if not os.path.exists(index_file):
+        return GitIndex()
+
+    with open(index_file, "rb") as f:
+        raw = f.read()
+
+    # The last 20 bytes are the SHA1 of everything before them
+    if hashlib.sha1(raw[:-20]).digest() != raw[-20:]:
+        raise Exception("Index file corrupt: bad checksum")
+
+    header = raw[:12]
+    signature = header[:4]
+    assert signature == b"DIRC" # Stands for "DirCache"
+    version = int.from_bytes(header[4:8], "big")
+    assert version == 2, "mygit only supports index file version 2"
+    count = int.from_bytes(header[8:12], "big")
+
+    entries = list()
+
+    content = raw[12:-20]
+    idx = 0
+
+    for i in range(0, count):
+
+        # Read creation time, as a unix timestamp (seconds since
+        # 1970-01-01 00:00:00, the "epoch") and nanoseconds
+        ctime_s = int.from_bytes(content[idx : idx+4], "big")
+        ctime_ns = int.from_bytes(content[idx+4 : idx+8], "big")
+
+        # Same for modification time
+        mtime_s = int.from_bytes(content[idx+8 : idx+12], "big")
+        mtime_ns = int.from_bytes(content[idx+12 : idx+16], "big")
+
+        dev = int.from_bytes(content[idx+16 : idx+20], "big")
+        ino = int.from_bytes(content[idx+20 : idx+24], "big")
+
+        # Ignored
+        unused = int.from_bytes(content[idx+24 : idx+26], "big")
+        assert 0 == unused
+
+        mode = int.from_bytes(content[idx+26 : idx+28], "big")
+        mode_type = mode >> 12
+        assert mode_type in [0b1000, 0b1010, 0b1110]
+        mode_perms = mode & 0b0000000111111111
+
+        uid = int.from_bytes(content[idx+28 : idx+32], "big")
+        gid = int.from_bytes(content[idx+32 : idx+36], "big")
+        fsize = int.from_bytes(content[idx+36 : idx+40], "big")
+        sha = content[idx+40 : idx+60].hex()
+
+        flags = int.from_bytes(content[idx+60 : idx+62], "big")
+        flag_assume_valid = (flags & 0b1000000000000000) != 0
+        flag_extended = (flags & 0b0100000000000000) != 0
+        assert not flag_extended
+        flag_stage = flags & 0b0011000000000000
+
+        # Length of the name, stored on 12 bits.  Names longer than
+        # 0xFFF are NULL-terminated and must be searched for
+        name_length = flags & 0b0000111111111111
+
+        idx += 62
+
+        if name_length < 0xFFF:
+            assert content[idx + name_length] == 0x00
+            raw_name = content[idx : idx+name_length]
+            idx += name_length + 1
+        else:
+            null_idx = content.find(b'\x00', idx + 0xFFF)
+            raw_name = content[idx : null_idx]
+            idx = null_idx + 1
+
+        name = raw_name.decode("utf8")
+
+        # Entries are padded with NULLs to a multiple of 8 bytes
+        idx = 8 * ceil(idx / 8)
+
+        entries.append(GitIndexEntry(ctime=(ctime_s, ctime_ns),
+                                     mtime=(mtime_s, mtime_ns),
+                                     dev=dev,
+                                     ino=ino,
+                                     mode_type=mode_type,
+                                     mode_perms=mode_perms,
+                                     uid=uid,
+                                     gid=gid,
+                                     fsize=fsize,
+                                     sha=sha,
+                                     flag_assume_valid=flag_assume_valid,
+                                     flag_stage=flag_stage,
+                                     name=name))
+
+    cache_tree = None
+
+    # Extensions: 4 bytes signature, 4 bytes size, then the data.  We
+    # only understand the cached tree, the other ones are optional and
+    # can be dropped
+    while idx < len(content):
+
+        signature = content[idx : idx+4]
+        size = int.from_bytes(content[idx+4 : idx+8], "big")
+        idx += 8
+
+        if signature == b"TREE":
+            _, cache_tree = cache_tree_parse(content[idx : idx+size])
+        elif not (b"A" <= signature[0:1] <= b"Z"):
+            raise Exception("Unsupported index extension {0}".format(signature))
+
+        idx += size
+
+    return GitIndex(version=version, entries=entries, cache_tree=cache_tree)
+
+
+@traced
+def index_write(repo, index):
+
+    import hashlib
+
+    ret = list()
+
+    # HEADER
+    ret.append(b"DIRC")
+    ret.append(index.version.to_bytes(4, "big"))
+    ret.append(len(index.entries).to_bytes(4, "big"))
+
+    # ENTRIES
+    idx = 0
+
+    for e in index.entries:
+
+        ret.append(e.ctime[0].to_bytes(4, "big"))
+        ret.append(e.ctime[1].to_bytes(4, "big"))
+        ret.append(e.mtime[0].to_bytes(4, "big"))
+        ret.append(e.mtime[1].to_bytes(4, "big"))
+        ret.append(e.dev.to_bytes(4, "big"))
+        ret.append(e.ino.to_bytes(4, "big"))
+
+        # Mode
+        mode = (e.mode_type << 12) | e.mode_perms
+        ret.append(mode.to_bytes(4, "big"))
+
+        ret.append(e.uid.to_bytes(4, "big"))
+        ret.append(e.gid.to_bytes(4, "big"))
+        ret.append(e.fsize.to_bytes(4, "big"))
+        ret.append(bytes.fromhex(e.sha))
+
+        flag_assume_valid = 0x1 << 15 if e.flag_assume_valid else 0
+
+        name_bytes = e.name.encode("utf8")
+        name_length = min(len(name_bytes), 0xFFF)
+
+        # We merge back three pieces of data (two flags and the
+        # length of the name) on the same two bytes
+        ret.append((flag_assume_valid | e.flag_stage | name_length).to_bytes(2, "big"))
+
+        # Write back the name, and a final 0x00
+        ret.append(name_bytes)
+        ret.append(b"\x00")
+
+        idx += 62 + len(name_bytes) + 1
+
+        # Add padding if necessary
+        if idx % 8 != 0:
+            pad = 8 - (idx % 8)
+            ret.append(b"\x00" * pad)
+            idx += pad
+
+    # EXTENSIONS
+    tree = cache_tree_serialize(index.cache_tree)
+    ret.append(b"TREE")
+    ret.append(len(tree).to_bytes(4, "big"))
+    ret.append(tree)
+
+    data = b"".join(ret)
+
+    with open(repo_file(repo, "index"), "wb") as f:
+        f.write(data)
+        f.write(hashlib.sha1(data).digest())
+
+
+def index_from_tree(repo, sha, node, prefix=""):
+    """Return index entries for the files of tree sha, as checked out in the
+worktree, and fill node with the cached trees we get for free."""
+
+    entries = list()
+
+    for leaf in object_read(repo, sha).items:
+
+        name = prefix + leaf.path
+
+        match tree_leaf_fmt(leaf):
+
+            case b'tree':
+                child = GitCacheTree(leaf.path, sha=leaf.sha)
+                children = index_from_tree(repo, leaf.sha, child, name + "/")
+                child.entry_count = len(children)
+                node.subtrees[leaf.path] = child
+                entries.extend(children)
+
+            case b'blob' | b'commit':
+                mode = int(leaf.mode.strip(), 8)
+                entries.append(index_entry_from_file(repo, name, leaf.sha, mode >> 12, mode & 0o777))
+
+    node.entry_count = len(entries)
+
+    return entries
+
+
+def index_entry_from_file(repo, name, sha, mode_type, mode_perms):
+
+    st = os.lstat(os.path.join(repo.worktree, name))
+
+    # The index stores these on 32 bits, git truncates them the same way
+    return GitIndexEntry(ctime=(int(st.st_ctime) & 0xFFFFFFFF, st.st_ctime_ns % 10**9),
+                         mtime=(int(st.st_mtime) & 0xFFFFFFFF, st.st_mtime_ns % 10**9),
+                         dev=st.st_dev & 0xFFFFFFFF,
+                         ino=st.st_ino & 0xFFFFFFFF,
+                         mode_type=mode_type,
+                         mode_perms=mode_perms,
+                         uid=st.st_uid & 0xFFFFFFFF,
+                         gid=st.st_gid & 0xFFFFFFFF,
+                         fsize=st.st_size & 0xFFFFFFFF,
+                         sha=sha,
+                         flag_assume_valid=False,
+                         flag_stage=0,
+                         name=name)
+
+
+# Example of a cache-tree node:
+#   [path] 0x00 [entry_count] 0x20 [subtree_count] 0x0a [sha-1 (only if entry_count >= 0)]
+# The root has an empty path, and each node is followed by its subtrees.
+def cache_tree_parse(raw, start=0):
+
+    path_len = raw.find(b'\x00', start)
+    name = raw[start:path_len].decode("utf8")
+
+    spc = raw.find(b' ', path_len)
+    nl = raw.find(b'\n', spc)
+
+    entry_count = int(raw[path_len+1 : spc])
+    subtree_count = int(raw[spc+1 : nl])
+
+    pos = nl + 1
+    node = GitCacheTree(name, entry_count)
+
+    # Invalid nodes have no SHA
+    if entry_count >= 0:
+        node.sha = raw[pos : pos+20].hex()
+        pos += 20
+
+    for i in range(subtree_count):
+        pos, child = cache_tree_parse(raw, pos)
+        node.subtrees[child.name] = child
+
+    return pos, node
+
+
+def cache_tree_serialize(node, ret=None):
+
+    if ret == None:
+        ret = list()
+
+    ret.append(node.name.encode("utf8"))
+    ret.append(b'\x00')
+    ret.append(str(node.entry_count).encode("ascii"))
+    ret.append(b' ')
+    ret.append(str(len(node.subtrees)).encode("ascii"))
+    ret.append(b'\n')
+
+    if node.sha != None:
+        ret.append(bytes.fromhex(node.sha))
+
+    for child in node.subtrees.values():
+        cache_tree_serialize(child, ret)
+
+    return b''.join(ret)
+
+
+def cache_tree_invalidate(index, path):
+    """Invalidate the cached trees of every directory containing path.
+
+Must be called whenever the index entry for path is added, removed or
+changed.  Only the ancestors of path are touched, so the next
+write-tree rebuilds O(depth) trees and reuses every other one."""
+
+    node = index.cache_tree
+    node.invalidate()
+
+    for name in path.split("/")[:-1]:
+
+        node = node.subtrees.get(name)
+
+        # Nothing cached below this point
+        if node == None:
+            return
+
+        node.invalidate()
+
+
+@traced
+def tree_from_index(repo, index):
+    """Write the tree objects for the index and return the SHA of the root.
+
+Trees still valid in the index's cache-tree are reused as they are, only
+the invalidated directories are re-serialized and written."""
+
+    for e in index.entries:
+        if e.flag_stage != 0:
+            raise Exception("Unmerged path {0}, cannot write a tree".format(e.name))
+
+    # Nothing changed since the last write-tree
+    if index.cache_tree.sha != None:
+        if TRACE:
+            trace_count("cache_tree_hits")
+        return index.cache_tree.sha
+
+    _, sha = tree_from_index_dir(repo, index.entries, 0, "", index.cache_tree)
+
+    return sha
+
+
+def tree_from_index_dir(repo, entries, start, prefix, node):
+
+    # Index entries are sorted by path, so everything below prefix is a
+    # contiguous run starting at start.  Returns the position right
+    # after that run, and the SHA of the tree built for it.
+    if TRACE:
+        trace_count("cache_tree_misses")
+
+    tree = GitTree()
+    subtrees = dict()
+
+    pos = start
+    count = len(entries)
+
+    while pos < count and entries[pos].name.startswith(prefix):
+
+        entry = entries[pos]
+        rel = entry.name[len(prefix):]
+
+        if "/" in rel:
+
+            # The entry lives in a subdirectory: reuse its cached tree
+            # if it's valid, otherwise build it
+            name = rel[:rel.index("/")]
+            child = node.subtrees.get(name)
+
+            if child == None:
+                child = GitCacheTree(name)
+
+            if child.sha != None:
+                pos += child.entry_count
+                if TRACE:
+                    trace_count("cache_tree_hits")
+            else:
+                pos, _ = tree_from_index_dir(repo, entries, pos, prefix + name + "/", child)
+
+            subtrees[name] = child
+            tree.items.append(GitTreeLeaf(b"40000", name, child.sha))
+
+        else:
+
+            mode = "{:02o}{:04o}".format(entry.mode_type, entry.mode_perms).encode("ascii")
+            tree.items.append(GitTreeLeaf(mode, rel, entry.sha))
+            pos += 1
+
+    # Drop the cached directories which disappeared from the index
+    node.subtrees = subtrees
+
+    node.sha = object_write(tree, repo)
+    node.entry_count = pos - start
+
+    return pos, node.sha
+
+
+def ref_resolve(repo, ref):
+    """Follow ref (e.g. \"HEAD\", \"refs/heads/master\") down to a SHA, None if it doesn't exist yet."""
+
+    path = repo_file(repo, ref)
+
+    # A branch without commits (e.g. master in a fresh repository)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        data = f.read().strip()
+
+    if data.startswith("ref: "):
+        return ref_resolve(repo, data[5:])
+    else:
+        return data
+
+
+def ref_list(repo, path=None):
+    """Return every ref below path (default .git/refs), as { "refs/heads/master": sha }."""
+
+    import collections
+
+    if not path:
+        path = repo_dir(repo, "refs")
+
+    ret = collections.OrderedDict()
+
+    # Git shows refs sorted
+    for f in sorted(os.listdir(path)):
+
+        can = os.path.join(path, f)
+
+        if os.path.isdir(can):
+            ret.update(ref_list(repo, can))
+        else:
+            ref = os.path.relpath(can, repo.gitdir).replace(os.sep, "/")
+            sha = ref_resolve(repo, ref)
+            if sha:
+                ret[ref] = sha
+
+    return ret
+
+
+def ref_write(repo, ref, value, old=False):
+    """Point ref at value.  Unless old is False, fail if ref doesn't hold old
+(None: if it exists) anymore, e.g. another commit moved the branch."""
+
+    path = repo_file(repo, *ref.split("/"), mkdir=True)
+
+    # Only one writer gets the lock, git honours it too
+    try:
+        fd = os.open(path + ".lock", os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    except FileExistsError:
+        raise Exception("Unable to lock {0}: {0}.lock exists, another process may be writing it".format(ref))
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(value + "\n")
+
+        if old != False:
+
+            current = None
+
+            if os.path.isfile(path):
+                with open(path, "r") as f:
+                    current = f.read().strip()
+
+            if current != old:
+                raise Exception("Cannot update {0}: expected {1}, found {2}".format(ref, old, current))
+
+        # Rename the lock over the ref, so readers see either the old
+        # value or the new one, never half a SHA
+        os.replace(path + ".lock", path)
+
+    except BaseException:
+        os.remove(path + ".lock")
+        raise
+
+
+def branch_get_active(repo):
+
+    with open(repo_file(repo, "HEAD"), "r") as f:
+        head = f.read()
+
+    if head.startswith("ref: refs/heads/"):
+        return head[16:].strip()
+    else:
+        return False
+
+
+def gitconfig_read(repo=None):
+
+    import configparser
+
+    xdg_config_home = os.environ["XDG_CONFIG_HOME"] if "XDG_CONFIG_HOME" in os.environ else "~/.config"
+
+    configfiles = [
+        os.path.expanduser(os.path.join(xdg_config_home, "git/config")),
+        os.path.expanduser("~/.gitconfig")
+    ]
+
+    # The repository's own config wins over the global ones
+    if repo:
+        configfiles.append(repo_file(repo, "config"))
+
+    config = configparser.ConfigParser()
+    config.read(configfiles)
+
+    return config
+
+
+def gitconfig_user_get(config):
+
+    if "user" in config:
+        if "name" in config["user"] and "email" in config["user"]:
+            return "{} <{}>".format(config["user"]["name"], config["user"]["email"])
+
+    return None
+
+
+def commit_create(repo, tree, parent, author, timestamp, message):
+
+    commit = GitCommit()
+
+    commit.commit[b"tree"] = tree.encode("ascii")
+
+    if parent:
+        commit.commit[b"parent"] = parent.encode("ascii")
+
+    # Format the timezone, e.g. +0200
+    offset = int(timestamp.astimezone().utcoffset().total_seconds())
+    sign = "-" if offset < 0 else "+"
+    offset = abs(offset)
+    tz = "{}{:02}{:02}".format(sign, offset // 3600, (offset % 3600) // 60)
+
+    author = "{0} {1} {2}".format(author, int(timestamp.timestamp()), tz)
+
+    commit.commit[b"author"] = author.encode("utf8")
+    commit.commit[b"committer"] = author.encode("utf8")
+    commit.commit[None] = (message.strip() + "\n").encode("utf8")
+
+    return object_write(commit, repo)
+
+
+
+# Object types with their own bitmap, in the order they are stored
+BITMAP_TYPES = [ b'commit', b'tree', b'blob', b'tag' ]
+
+# A 64 bits word with every bit set
+EWAH_ONES = 0xFFFFFFFFFFFFFFFF
+
+
+# EWAH compressed bitmap, as used by git's .bitmap files:
+#   [bit count (4)] [word count (4)] [words (8 each)] [position of the last marker word (4)]
+# Each marker word tells how many clean words (all 0 or all 1, bit 0 says
+# which) follow on bits 1-32, then how many literal words come after them
+# on bits 33-63.  Everything is big-endian.
+def ewah_serialize(bits, size):
+
+    import struct
+
+    nwords = (size + 63) // 64
+    words = struct.unpack("<%dQ" % nwords, bits.to_bytes(nwords * 8, "little"))
+
+    ret = list()
+    last_rlw = 0
+    i = 0
+
+    while i < nwords:
+
+        # Run of clean words
+        run_bit = 0
+        run = 0
+        w = words[i]
+
+        if w == 0 or w == EWAH_ONES:
+            run_bit = 1 if w == EWAH_ONES else 0
+            while i < nwords and words[i] == w and run < 0xFFFFFFFF:
+                run += 1
+                i += 1
+
+        # Literal words up to the next clean one
+        lit_start = i
+        while i < nwords and words[i] != 0 and words[i] != EWAH_ONES and i - lit_start < 0x7FFFFFFF:
+            i += 1
+
+        last_rlw = len(ret)
+        ret.append(run_bit | (run << 1) | ((i - lit_start) << 33))
+        ret.extend(words[lit_start:i])
+
+    return struct.pack(">II%dQI" % len(ret), size, len(ret), *ret, last_rlw)
+
+
+def ewah_parse(raw, start=0):
+
+    import struct
+
+    size, count = struct.unpack_from(">II", raw, start)
+    compressed = struct.unpack_from(">%dQ" % count, raw, start+8)
+
+    words = list()
+    i = 0
+
+    while i < count:
+        rlw = compressed[i]
+        run = (rlw >> 1) & 0xFFFFFFFF
+        literals = rlw >> 33
+
+        if run:
+            words.extend([ EWAH_ONES if rlw & 1 else 0 ] * run)
+
+        words.extend(compressed[i+1 : i+1+literals])
+        i += 1 + literals
+
+    bits = int.from_bytes(struct.pack("<%dQ" % len(words), *words), "little")
+
+    return start + 8 + 8*count + 4, bits
+
+
+@traced
+def bitmap_read(repo):
+    """Read .git/objects/info/bitmap, None if there isn't one."""
+
+    import hashlib, struct
+
+    path = repo_path(repo, "objects", "info", "bitmap")
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if hashlib.sha1(raw[:-20]).digest() != raw[-20:]:
+        raise Exception("Bitmap index corrupt: bad checksum")
+
+    assert raw[0:4] == b"BITM"
+    version, nobjects, ncommits = struct.unpack_from(">III", raw, 4)
+    assert version == 1, "mygit only supports bitmap version 1"
+
+    pos = 16
+    table = [ raw[i : i+20].hex() for i in range(pos, pos + 20*nobjects, 20) ]
+    pos += 20 * nobjects
+
+    types = dict()
+    for fmt in BITMAP_TYPES:
+        pos, types[fmt] = ewah_parse(raw, pos)
+
+    commits = dict()
+    for i in range(ncommits):
+        commit_pos = int.from_bytes(raw[pos : pos+4], "big")
+        pos, commits[table[commit_pos]] = ewah_parse(raw, pos+4)
+
+    return GitBitmapIndex(table, types, commits)
+
+
+@traced
+def bitmap_write(repo, tips, interval=100):
+    """Index every object reachable from tips and write the bitmap file.
+
+Tips get a bitmap, and so does one commit every interval commits of
+history, so that a walk from anywhere meets one quickly."""
+
+    import hashlib, struct
+
+    tips, objects = tips_peel(repo, tips)
+    order, info = commit_topo_order(repo, tips)
+
+    # Give a position to every object, commits first in topological order,
+    # then each commit's trees and blobs not seen before, then the tags,
+    # trees and blobs the tips point to directly
+    table = list()
+    positions = dict()
+    types = { fmt: list() for fmt in BITMAP_TYPES }
+
+    for sha in order:
+        bitmap_table_add(repo, table, positions, types, sha, b'commit')
+        bitmap_table_add(repo, table, positions, types, info[sha][0], b'tree')
+
+    for sha, fmt in objects:
+        bitmap_table_add(repo, table, positions, types, sha, fmt)
+
+    bitmap = GitBitmapIndex(table, { fmt: bits_from_positions(p, len(table)) for fmt, p in types.items() })
+    bitmap._positions = positions
+
+    # Parents come first in order, so each walk can stop at the bitmaps of
+    # the selected commits before it
+    selected = set(tips) | set(order[interval-1::interval])
+
+    for sha in order:
+        if sha in selected:
+            bitmap.commits[sha], _ = bitmap_walk(repo, [ sha ], bitmap)
+
+    # Serialize
+    ret = list()
+    ret.append(b"BITM")
+    ret.append(struct.pack(">III", 1, len(table), len(bitmap.commits)))
+    ret.extend(bytes.fromhex(sha) for sha in table)
+
+    for fmt in BITMAP_TYPES:
+        ret.append(ewah_serialize(bitmap.types[fmt], len(table)))
+
+    for sha, bits in bitmap.commits.items():
+        ret.append(positions[sha].to_bytes(4, "big"))
+        ret.append(ewah_serialize(bits, len(table)))
+
+    data = b"".join(ret)
+
+    # Write to a temporary file first, readers never see half a bitmap
+    path = repo_file(repo, "objects", "info", "bitmap", mkdir=True)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        f.write(hashlib.sha1(data).digest())
+
+    os.replace(path + ".tmp", path)
+
+    return bitmap
+
+
+def bitmap_table_add(repo, table, positions, types, sha, fmt):
+
+    # A tree brings everything below it along
+    stack = [ (sha, fmt) ]
+
+    while stack:
+
+        sha, fmt = stack.pop()
+
+        # A known tree means we already indexed everything below it
+        if sha in positions:
+            continue
+
+        positions[sha] = len(table)
+        types[fmt].append(len(table))
+        table.append(sha)
+
+        if fmt == b'tree':
+            for leaf in reversed(object_read(repo, sha).items):
+                leaf_fmt = tree_leaf_fmt(leaf)
+                if leaf_fmt != b'commit':
+                    stack.append((leaf.sha, leaf_fmt))
+
+
+def commit_topo_order(repo, tips, known=()):
+    """Return every commit reachable from tips, parents before children,
+and a dict sha -> (tree, parents) of what we read along the way.  The walk
+stops at the commits in known: they are neither read nor ordered, and map
+to None."""
+
+    order = list()
+    info = dict()
+    stack = [ (sha, False) for sha in tips ]
+
+    while stack:
+
+        sha, done = stack.pop()
+
+        # All the parents of sha are in order already
+        if done:
+            order.append(sha)
+            continue
+
+        if sha in info:
+            continue
+
+        if sha in known:
+            info[sha] = None
+            continue
+
+        commit = object_read(repo, sha)
+        parents = commit_parents(commit)
+        info[sha] = (commit.commit[b'tree'].decode("ascii"), parents)
+
+        stack.append((sha, True))
+        stack.extend((p, False) for p in parents if not p in info)
+
+    return order, info
+
+
+def tips_peel(repo, tips, commits=()):
+    """Follow the annotated tags among tips, return (commits, objects): the
+commits the tips point to, and the other objects they name as (sha, fmt),
+i.e. the tag objects met on the way and the trees and blobs at the end of
+them.  Tips found in commits are known commits and aren't read."""
+
+    ret = list()
+    objects = list()
+
+    for sha in tips:
+
+        if sha in commits:
+            ret.append(sha)
+            continue
+
+        obj = object_read(repo, sha)
+
+        if obj == None:
+            raise Exception("Not a valid object name: {0}".format(sha))
+
+        while obj.fmt == b'tag':
+            objects.append((sha, b'tag'))
+            sha = obj.commit[b'object'].decode("ascii")
+            obj = object_read(repo, sha)
+
+        if obj.fmt == b'commit':
+            ret.append(sha)
+        else:
+            objects.append((sha, obj.fmt))
+
+    return ret, objects
+
+
+def commit_parents(commit):
+
+    parents = commit.commit.get(b'parent', [])
+
+    if type(parents) != list:
+        parents = [ parents ]
+
+    return [ p.decode("ascii") for p in parents ]
+
+
+def tree_leaf_fmt(leaf):
+
+    # tree_parse() pads modes to six bytes, so " 40000" is a tree too
+    mode = leaf.mode.lstrip(b" 0")
+
+    if mode.startswith(b"4"):
+        return b'tree'
+    elif mode.startswith(b"16"):
+        return b'commit' # A submodule, not in our object store
+    else:
+        return b'blob'
+
+
+def bits_from_positions(positions, size):
+
+    # Setting bits one at a time on an int copies it every time, a
+    # bytearray doesn't
+    bits = bytearray((size + 7) // 8)
+
+    for pos in positions:
+        bits[pos >> 3] |= 1 << (pos & 7)
+
+    return int.from_bytes(bits, "little")
+
+
+@traced
+def bitmap_walk(repo, tips, bitmap):
+    """Return the objects reachable from tips as (bits, extra).
+
+Commits with a bitmap are OR-ed in without being read, only the
+history between the tips and them is walked.  Objects missing from the
+bitmap's table (written after it) end up in extra, as { sha: fmt }."""
+
+    tips, objects = tips_peel(repo, tips, bitmap.commits)
+
+    # First the commits: stop at every one we have a bitmap for
+    order, info = commit_topo_order(repo, tips, bitmap.commits)
+    ored = 0
+
+    for sha, commit in info.items():
+        if commit == None:
+            ored |= bitmap.commits[sha]
+            if TRACE:
+                trace_count("bitmap_hits")
+
+    # Only needed to mark objects one at a time, a query answered by
+    # bitmaps alone doesn't build it
+    positions = bitmap.positions() if order or objects else dict()
+
+    # Then the trees of the commits the bitmaps didn't cover, newest first
+    # so that extra lists commits in the order rev-list prints them
+    bits = bytearray(ored.to_bytes((len(bitmap.table) + 7) // 8, "little"))
+    extra = dict()
+
+    for sha in reversed(order):
+        if bits_mark(bits, positions, extra, sha, b'commit'):
+            bits_mark_tree(repo, bits, positions, extra, info[sha][0])
+
+    # Last what the tips name besides commits
+    for sha, fmt in objects:
+        if fmt == b'tree':
+            bits_mark_tree(repo, bits, positions, extra, sha)
+        else:
+            bits_mark(bits, positions, extra, sha, fmt)
+
+    return int.from_bytes(bits, "little"), extra
+
+
+def bits_mark_tree(repo, bits, positions, extra, tree):
+
+    stack = [ tree ]
+
+    while stack:
+
+        tree = stack.pop()
+
+        # Already there, and so is everything below it
+        if not bits_mark(bits, positions, extra, tree, b'tree'):
+            continue
+
+        for leaf in object_read(repo, tree).items:
+            match tree_leaf_fmt(leaf):
+                case b'tree': stack.append(leaf.sha)
+                case b'blob': bits_mark(bits, positions, extra, leaf.sha, b'blob')
+
+
+def bits_mark(bits, positions, extra, sha, fmt):
+
+    # Returns False if the object was already marked
+    pos = positions.get(sha)
+
+    if pos == None:
+        if sha in extra:
+            return False
+        extra[sha] = fmt
+        return True
+
+    if bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+
+    bits[pos >> 3] |= 1 << (pos & 7)
+    return True
+
+
+def reachable_objects(repo, tips, bitmap=None):
+    """Return every object reachable from tips, as { sha: fmt }.  Commits
+come first, newest first (children before their parents), then trees,
+blobs and tags."""
+
+    if bitmap == None:
+        bitmap = bitmap_read(repo) or GitBitmapIndex()
+
+    bits, extra = bitmap_walk(repo, tips, bitmap)
+
+    # Commits missing from the table are newer than all of the ones in it
+    ret = { sha: fmt for sha, fmt in extra.items() if fmt == b'commit' }
+
+    for fmt in BITMAP_TYPES:
+
+        data = (bits & bitmap.types.get(fmt, 0)).to_bytes((len(bitmap.table) + 7) // 8, "little")
+        found = list()
+
+        for i, byte in enumerate(data):
+            if byte:
+                for j in range(8):
+                    if byte & (1 << j):
+                        found.append(bitmap.table[i*8 + j])
+
+        # The table has parents before children
+        if fmt == b'commit':
+            found.reverse()
+
+        ret.update((sha, fmt) for sha in found)
+
+    ret.update(extra)
+
+    return ret
+
+
+def reachable_count(repo, tips, bitmap=None, fmt=None):
+    """Count the objects reachable from tips, only those of type fmt if given."""
+
+    if bitmap == None:
+        bitmap = bitmap_read(repo) or GitBitmapIndex()
+
+    bits, extra = bitmap_walk(repo, tips, bitmap)
+
+    if fmt != None:
+        bits &= bitmap.types.get(fmt, 0)
+        extra = [ sha for sha, obj_fmt in extra.items() if obj_fmt == fmt ]
+
+    return bits.bit_count() + len(extra)
+
+
+
+# End utilities
+# -----------------------------------------------------------------------------------------
+
+
+
+
+# -----------------------------------------------------------------------------------------
+# Begin async API
+
+
+# Biggest cached object AsyncRepository.read_object() parses on the event loop
+ASYNC_INLINE_MAX = 16 * 1024
+
+
+class AsyncRepository (object):
+    """Asyncio facade over a GitRepository, for services answering many
+requests at once.
+
+The blocking work (file reads, zlib) runs on a pool of max_workers
+threads, however many requests are waiting.  Concurrent reads of the
+same SHA share a single read, and every read goes through the object
+cache shared with object_read().  An instance belongs to one event loop."""
+
+    def __init__(self, repo, max_workers=8, executor=None):
+
+        import concurrent.futures
+
+        self.repo = repo
+        self.own_executor = executor == None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mygit")
+        self.inflight = dict()      # sha -> future of the read in progress
+
+    @classmethod
+    async def find(cls, path=".", **kwargs):
+        """Same as repo_find(), without blocking the event loop."""
+
+        ret = cls(None, **kwargs)
+        ret.repo = await ret.run(repo_find, path)
+
+        return ret
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the executor."""
+
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def prefetch(self, sha):
+        """Start reading sha and return the future of the read, without
+waiting for it.  If a read of sha is already running, return its future."""
+
+        import asyncio
+
+        future = self.inflight.get(sha)
+
+        if future == None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, object_read, self.repo, sha)
+            self.inflight[sha] = future
+            future.add_done_callback(lambda f: self.prefetch_done(sha, f))
+
+        return future
+
+    def prefetch_done(self, sha, future):
+
+        self.inflight.pop(sha, None)
+
+        # Nobody may ever await a prefetch, retrieve its exception so that
+        # asyncio doesn't log it.  Those who await it still get it
+        if not future.cancelled():
+            future.exception()
+
+    async def resolve(self, name):
+        return await self.run(object_find, self.repo, name)
+
+    async def read_object(self, sha):
+
+        import asyncio
+
+        raw = object_cache_get().get(object_cache_key(self.repo, sha))
+
+        # Cached and small: parsing it is quicker than a trip to a thread.
+        # Big trees are parsed on the executor, not on the event loop
+        if raw != None and len(raw[1]) <= ASYNC_INLINE_MAX:
+            return object_build(raw[0], raw[1], sha)
+
+        # Shielded: a cancelled request mustn't cancel the read for the
+        # others waiting on it
+        return await asyncio.shield(self.prefetch(sha))
+
+    async def iter_tree(self, sha, recursive=False, prefix=""):
+        """Yield (mode, fmt, sha, path) for each entry of the tree (or
+commit) sha, like ls_tree().  With recursive, the subtrees of a tree are
+all read concurrently."""
+
+        tree = await self.read_object(sha)
+
+        if tree.fmt == b'commit':
+            tree = await self.read_object(tree.commit[b'tree'].decode("ascii"))
+
+        if recursive:
+            for leaf in tree.items:
+                if tree_leaf_fmt(leaf) == b'tree':
+                    self.prefetch(leaf.sha)
+
+        for leaf in tree.items:
+
+            fmt = tree_leaf_fmt(leaf)
+            path = os.path.join(prefix, leaf.path)
+
+            if recursive and fmt == b'tree':
+                async for item in self.iter_tree(leaf.sha, recursive, path):
+                    yield item
+            else:
+                yield leaf.mode.strip(), fmt, leaf.sha, path
+
+    async def walk_log(self, sha):
+        """Yield (sha, commit) for sha and each of its ancestors once, in
+the order log_graphviz() visits them.  The parents of a commit are read
+while the caller handles it."""
+
+        seen = set()
+        stack = [ sha ]
+
+        while stack:
+
+            sha = stack.pop()
+
+            if sha in seen:
+                continue
+
+            seen.add(sha)
+
+            commit = await self.read_object(sha)
+            parents = commit_parents(commit)
+
+            for p in parents:
+                if not p in seen:
+                    self.prefetch(p)
+
+            yield sha, commit
+
+            # First parent on top, to be visited first
+            stack.extend(reversed(parents))
+
+
+# End async API
 # -----------------------------------------------------------------------------------------
@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import mygitlib
+from synthrepo import synth_repo
+
+
+# Each benchmark is a setup(ctx) returning the state one run needs, and a
+# run(ctx, state) which is the only thing timed.  setup is called before
+# every run, so runs that consume their state (checkout) stay comparable.
+
+def raw_objects(ctx, fmt):
+
+    # Payloads of every object of type fmt, without the header
+    ret = list()
+
+    for sha, obj_fmt in ctx["objects"].items():
+        if obj_fmt == fmt:
+            with open(mygitlib.object_path(ctx["repo"], sha), "rb") as f:
+                raw = zlib.decompress(f.read())
+            ret.append(raw[raw.index(b'\x00')+1:])
+
+    return ret
+
+
+def setup_cold(ctx):
+
+    # Measure the reads from disk, not the object cache filled by the
+    # previous run
+    mygitlib.object_cache_get().clear()
+
+
+def bench_object_read(ctx, state):
+    for sha in ctx["objects"]:
+        mygitlib.object_read(ctx["repo"], sha)
+
+
+def bench_tree_parse(ctx, state):
+    for raw in state:
+        mygitlib.tree_parse(raw)
+
+
+def bench_commit_parse(ctx, state):
+    for raw in state:
+        mygitlib.commit_parse(raw)
+
+
+def setup_tree_checkout(ctx):
+    setup_cold(ctx)
+    return tempfile.mkdtemp(dir=ctx["tmp"])
+
+
+def bench_tree_checkout(ctx, state):
+    tree = mygitlib.object_read(ctx["repo"], ctx["tree"])
+    mygitlib.tree_checkout(ctx["repo"], tree, state)
+
+
+def bench_log_graphviz(ctx, state):
+    with contextlib.redirect_stdout(io.StringIO()):
+        mygitlib.log_graphviz(ctx["repo"], ctx["head"], set())
+
+
+BENCHMARKS = {
+    "object_read"   : (setup_cold, bench_object_read),
+    "tree_parse"    : (lambda ctx: raw_objects(ctx, b'tree'), bench_tree_parse),
+    "commit_parse"  : (lambda ctx: raw_objects(ctx, b'commit'), bench_commit_parse),
+    "tree_checkout" : (setup_tree_checkout, bench_tree_checkout),
+    "log_graphviz"  : (setup_cold, bench_log_graphviz),
+}
+
+
+def bench_one(ctx, setup, run, warmup, repeat):
+
+    times = list()
+
+    for i in range(warmup + repeat):
+        state = setup(ctx)
+        start = time.perf_counter()
+        run(ctx, state)
+        elapsed = time.perf_counter() - start
+
+        # Warmup runs fill the OS caches, they aren't recorded
+        if i >= warmup:
+            times.append(elapsed)
+
+    return {
+        "min"    : min(times),
+        "median" : statistics.median(times),
+        "mean"   : statistics.mean(times),
+        "stdev"  : statistics.stdev(times) if len(times) > 1 else 0.0,
+        "runs"   : times,
+    }
+
+
+def bench_compare(results, baseline, threshold):
+    """Print each benchmark against baseline, return the names of the ones
+slower than baseline by more than threshold (0.1 is 10%)."""
+
+    regressions = list()
+
+    for name, result in results["results"].items():
+
+        if not name in baseline["results"]:
+            print("{0:<16} {1:>10.4f}s  (no baseline)".format(name, result["median"]))
+            continue
+
+        base = baseline["results"][name]["median"]
+        ratio = result["median"] / base if base else float("inf")
+        flag = ""
+
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+
+        print("{0:<16} {1:>10.4f}s  baseline {2:>10.4f}s  {3:>+7.1%}{4}".format(name, result["median"], base, ratio - 1, flag))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark mygit's hot paths on a synthetic repository.")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files")
+    parser.add_argument("--fanout", type=int, default=4, help="Subdirectories per directory")
+    parser.add_argument("--depth", type=int, default=3, help="Levels of subdirectories")
+    parser.add_argument("--commits", type=int, default=200, help="Length of the history")
+    parser.add_argument("--changes", type=int, default=3, help="Files changed by each commit")
+    parser.add_argument("--merge-density", type=float, default=0.1, help="Probability for a commit to be a merge")
+    parser.add_argument("--blob-size", type=int, default=2048, help="Median blob size, in bytes")
+    parser.add_argument("--blob-sigma", type=float, default=1.0, help="Spread of the log-normal blob sizes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before measuring")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--output", metavar="file", help="Write the results as JSON to file")
+    parser.add_argument("--baseline", metavar="file", help="Compare with the JSON results in file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown over the baseline counted as a regression")
+    args = parser.parse_args()
+
+    params = { k: getattr(args, k) for k in ["files", "fanout", "depth", "commits", "changes",
+                                             "merge_density", "blob_size", "blob_sigma", "seed"] }
+
+    # log_graphviz and tree_checkout recurse once per commit / directory level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * args.commits + 1000))
+
+    tmp = tempfile.mkdtemp(prefix="mygit-bench-")
+
+    try:
+        repo, head = synth_repo(os.path.join(tmp, "repo"), **params)
+
+        ctx = {
+            "repo"    : repo,
+            "head"    : head,
+            "tree"    : mygitlib.object_read(repo, head).commit[b'tree'].decode("ascii"),
+            "objects" : mygitlib.reachable_objects(repo, [ head ]),
+            "tmp"     : tmp,
+        }
+
+        results = {
+            "params"  : params,
+            "python"  : platform.python_version(),
+            "results" : dict(),
+        }
+
+        for name, (setup, run) in BENCHMARKS.items():
+            if args.only and not name in args.only:
+                continue
+            results["results"][name] = bench_one(ctx, setup, run, args.warmup, args.repeat)
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+        if baseline["params"] != params:
+            print("warning: baseline was measured with different parameters", file=sys.stderr)
+
+        if bench_compare(results, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        for name, result in results["results"].items():
+            print("{0:<16} {1:>10.4f}s  (min {2:.4f}s, stdev {3:.4f}s)".format(name, result["median"], result["min"], result["stdev"]))
+
+if __name__ == '__main__':
+    main()
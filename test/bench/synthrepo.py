@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import mygitlib
+
+
+# Every synthetic commit has the same author, and time moves forward one
+# minute per commit, so the same parameters always give the same SHAs
+AUTHOR = b"Synthetic Author <synthetic@example.com>"
+EPOCH = 1500000000
+
+
+def synth_dirs(fanout, depth):
+
+    # Every directory of a tree with fanout subdirectories per level
+    dirs = [ "" ]
+    level = [ "" ]
+
+    for d in range(depth):
+        level = [ "{0}d{1}/".format(parent, i) for parent in level for i in range(fanout) ]
+        dirs.extend(level)
+
+    return dirs
+
+
+def synth_blob(rng, blob_size, blob_sigma):
+
+    # Sizes follow a log-normal distribution around blob_size, like source
+    # trees where most files are small and a few are big
+    size = max(1, int(rng.lognormvariate(0, blob_sigma) * blob_size))
+    return rng.randbytes(size)
+
+
+def synth_commit(repo, tree, parents, n, message):
+
+    commit = mygitlib.GitCommit()
+    commit.commit[b"tree"] = tree.encode("ascii")
+
+    if parents:
+        commit.commit[b"parent"] = [ p.encode("ascii") for p in parents ] if len(parents) > 1 else parents[0].encode("ascii")
+
+    stamp = AUTHOR + " {0} +0000".format(EPOCH + 60*n).encode("ascii")
+    commit.commit[b"author"] = stamp
+    commit.commit[b"committer"] = stamp
+    commit.commit[None] = message.encode("utf8") + b"\n"
+
+    return mygitlib.object_write(commit, repo)
+
+
+def synth_change(repo, index, rng, blob_size, blob_sigma):
+
+    # Rewrite one random file, only its directories need new trees
+    entry = rng.choice(index.entries)
+    entry.sha = mygitlib.object_write(mygitlib.GitBlob(synth_blob(rng, blob_size, blob_sigma)), repo)
+    mygitlib.cache_tree_invalidate(index, entry.name)
+
+
+def synth_repo(path, files=1000, fanout=4, depth=3, commits=200, changes=3,
+               merge_density=0.1, blob_size=2048, blob_sigma=1.0, seed=0):
+    """Create a repository at path with a deterministic synthetic history.
+
+The first commit adds files blobs spread over a tree of fanout
+directories per level, depth levels deep.  Each following commit
+rewrites changes random files.  With probability merge_density a commit
+is instead merged from a one-commit side branch."""
+
+    rng = random.Random(seed)
+    repo = mygitlib.GitRepository(mygitlib.repo_create(path).worktree)
+
+    # The index is only used to build trees, through the cache-tree
+    dirs = synth_dirs(fanout, depth)
+    index = mygitlib.GitIndex()
+
+    for i in range(files):
+        sha = mygitlib.object_write(mygitlib.GitBlob(synth_blob(rng, blob_size, blob_sigma)), repo)
+        index.entries.append(mygitlib.GitIndexEntry(mode_type=0b1000, mode_perms=0o644, sha=sha,
+                                                    flag_stage=0, name="{0}f{1}".format(rng.choice(dirs), i)))
+
+    index.entries.sort(key=lambda e: e.name.encode("utf8"))
+
+    head = synth_commit(repo, mygitlib.tree_from_index(repo, index), [], 0, "Initial commit")
+
+    for n in range(1, commits):
+
+        if rng.random() < merge_density:
+            synth_change(repo, index, rng, blob_size, blob_sigma)
+            side = synth_commit(repo, mygitlib.tree_from_index(repo, index), [ head ], n, "Side commit {0}".format(n))
+            head = synth_commit(repo, mygitlib.tree_from_index(repo, index), [ head, side ], n, "Merge commit {0}".format(n))
+            continue
+
+        for c in range(changes):
+            synth_change(repo, index, rng, blob_size, blob_sigma)
+
+        head = synth_commit(repo, mygitlib.tree_from_index(repo, index), [ head ], n, "Commit {0}".format(n))
+
+    mygitlib.ref_write(repo, "refs/heads/master", head)
+
+    return repo, head
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic repository.")
+    parser.add_argument("path", help="Where to create the repository.")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files")
+    parser.add_argument("--fanout", type=int, default=4, help="Subdirectories per directory")
+    parser.add_argument("--depth", type=int, default=3, help="Levels of subdirectories")
+    parser.add_argument("--commits", type=int, default=200, help="Length of the history")
+    parser.add_argument("--changes", type=int, default=3, help="Files changed by each commit")
+    parser.add_argument("--merge-density", type=float, default=0.1, help="Probability for a commit to be a merge")
+    parser.add_argument("--blob-size", type=int, default=2048, help="Median blob size, in bytes")
+    parser.add_argument("--blob-sigma", type=float, default=1.0, help="Spread of the log-normal blob sizes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    repo, head = synth_repo(args.path, files=args.files, fanout=args.fanout, depth=args.depth,
+                            commits=args.commits, changes=args.changes, merge_density=args.merge_density,
+                            blob_size=args.blob_size, blob_sigma=args.blob_sigma, seed=args.seed)
+    print(head)
+
+if __name__ == '__main__':
+    main()
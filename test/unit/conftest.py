@@ -0,0 +1,41 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "test", "bench"))
+
+# A fixed identity and dates, so git computes the same SHAs we do
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME="Test", GIT_AUTHOR_EMAIL="test@example.com", GIT_AUTHOR_DATE="1500000000 +0000",
+               GIT_COMMITTER_NAME="Test", GIT_COMMITTER_EMAIL="test@example.com", GIT_COMMITTER_DATE="1500000000 +0000",
+               GIT_CONFIG_NOSYSTEM="1", HOME=os.devnull)
+
+
+def git_run(cwd, *args):
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def git():
+    """Run real git, to build repositories and check what mygit wrote."""
+
+    if not shutil.which("git"):
+        pytest.skip("git is not installed")
+
+    return git_run
+
+
+@pytest.fixture(autouse=True)
+def object_cache_clear():
+
+    # The object cache lives as long as the process, don't let one test
+    # see what another one read
+    import mygitlib
+
+    mygitlib.object_cache_get().clear()
@@ -0,0 +1,114 @@
+import asyncio
+import gc
+
+import pytest
+
+import mygitlib
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return mygitlib.GitRepository(mygitlib.repo_create(str(tmp_path)).worktree)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Count the object_read() calls made on the executor."""
+
+    calls = list()
+    object_read = mygitlib.object_read
+
+    def counted(repo, sha):
+        calls.append(sha)
+        return object_read(repo, sha)
+
+    monkeypatch.setattr(mygitlib, "object_read", counted)
+
+    return calls
+
+
+def test_read_object_coalesced(repo, reads):
+
+    shas = [ mygitlib.object_write(mygitlib.GitBlob(str(i).encode("ascii")), repo) for i in range(10) ]
+
+    async def main():
+        async with mygitlib.AsyncRepository(repo, max_workers=8) as arepo:
+            return await asyncio.gather(*[ arepo.read_object(shas[i % 10]) for i in range(5000) ])
+
+    objs = asyncio.run(main())
+
+    assert [ obj.blobdata for obj in objs ] == [ str(i % 10).encode("ascii") for i in range(5000) ]
+    assert sorted(reads) == sorted(shas)
+
+
+def test_read_object_cached(repo, reads):
+
+    small = mygitlib.object_write(mygitlib.GitBlob(b"small"), repo)
+    big = mygitlib.object_write(mygitlib.GitBlob(b"x" * (mygitlib.ASYNC_INLINE_MAX + 1)), repo)
+
+    mygitlib.object_read(repo, small)
+    mygitlib.object_read(repo, big)
+    reads.clear()
+
+    async def main():
+        async with mygitlib.AsyncRepository(repo) as arepo:
+            return await arepo.read_object(small), await arepo.read_object(big)
+
+    small_obj, big_obj = asyncio.run(main())
+
+    assert small_obj.blobdata == b"small"
+    assert len(big_obj.blobdata) == mygitlib.ASYNC_INLINE_MAX + 1
+
+    # Only the big one leaves the event loop
+    assert reads == [ big ]
+
+
+def test_read_object_cancelled(repo):
+
+    sha = mygitlib.object_write(mygitlib.GitBlob(b"data"), repo)
+
+    async def main():
+        async with mygitlib.AsyncRepository(repo) as arepo:
+
+            first = asyncio.ensure_future(arepo.read_object(sha))
+            second = asyncio.ensure_future(arepo.read_object(sha))
+            await asyncio.sleep(0)
+
+            # The read both share keeps going for the other one
+            first.cancel()
+
+            return await second
+
+    assert asyncio.run(main()).blobdata == b"data"
+
+
+def test_prefetch_exception_retrieved(repo, monkeypatch):
+
+    def broken(repo, sha):
+        raise OSError("broken")
+
+    monkeypatch.setattr(mygitlib, "object_read", broken)
+
+    errors = list()
+
+    async def main():
+
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+
+        async with mygitlib.AsyncRepository(repo) as arepo:
+
+            future = arepo.prefetch("0" * 40)
+            await asyncio.wait([ future ])
+
+            assert isinstance(future.exception(), OSError)
+            assert arepo.inflight == {}
+
+            # Never awaited
+            arepo.prefetch("1" * 40)
+            await asyncio.sleep(0.1)
+
+        gc.collect()
+
+    asyncio.run(main())
+
+    assert errors == []
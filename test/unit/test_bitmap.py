@@ -0,0 +1,158 @@
+import datetime
+import random
+
+import pytest
+
+import mygitlib
+from synthrepo import synth_repo
+
+
+@pytest.mark.parametrize("size", [ 1, 63, 64, 65, 1000, 100000 ])
+def test_ewah_round_trip(size):
+
+    rng = random.Random(size)
+
+    for bits in [ 0,
+                  rng.getrandbits(size),
+                  (1 << size) - 1,                          # a single run of ones
+                  ((1 << size) - 1) ^ (1 << (size // 2)),   # ones, one hole
+                  (1 << (size - 1)) | 5 ]:                  # mostly zeros
+
+        raw = mygitlib.ewah_serialize(bits, size)
+        end, parsed = mygitlib.ewah_parse(raw)
+
+        assert parsed == bits
+        assert end == len(raw)
+
+
+@pytest.fixture
+def synthetic(tmp_path):
+    return synth_repo(str(tmp_path / "repo"), files=60, fanout=2, depth=2, commits=40, merge_density=0.2)
+
+
+def test_bitmap_matches_walk(synthetic):
+
+    repo, head = synthetic
+
+    walked = mygitlib.reachable_objects(repo, [ head ])
+    assert mygitlib.bitmap_read(repo) == None
+
+    bitmap = mygitlib.bitmap_write(repo, [ head ], interval=7)
+    assert len(bitmap.commits) > 1
+
+    # Read back from disk
+    bitmap = mygitlib.bitmap_read(repo)
+
+    assert mygitlib.reachable_objects(repo, [ head ], bitmap) == walked
+    assert mygitlib.reachable_count(repo, [ head ], bitmap) == len(walked)
+    assert mygitlib.reachable_count(repo, [ head ], bitmap, fmt=b'commit') == sum(1 for f in walked.values() if f == b'commit')
+
+    # From an older commit, only part of the history
+    parent = mygitlib.commit_parents(mygitlib.object_read(repo, head))[0]
+    assert mygitlib.reachable_objects(repo, [ parent ], bitmap) == mygitlib.reachable_objects(repo, [ parent ], mygitlib.GitBitmapIndex())
+
+
+def test_bitmap_objects_written_after(synthetic):
+
+    repo, head = synthetic
+    mygitlib.bitmap_write(repo, [ head ])
+
+    tree = mygitlib.object_read(repo, head).commit[b'tree'].decode("ascii")
+    commit = mygitlib.commit_create(repo, tree, head, "Test <test@example.com>", datetime.datetime.now(), "after")
+
+    objects = mygitlib.reachable_objects(repo, [ commit ])
+
+    assert objects[commit] == b'commit'
+    assert objects == mygitlib.reachable_objects(repo, [ commit ], mygitlib.GitBitmapIndex())
+
+
+def test_bitmap_annotated_tag(synthetic, git):
+
+    repo, head = synthetic
+    git(repo.worktree, "tag", "-a", "v1", "-m", "Version 1", head)
+
+    tag = mygitlib.object_find(repo, "v1")
+    assert mygitlib.object_read(repo, tag).fmt == b'tag'
+
+    expected = set(git(repo.worktree, "rev-list", "--objects", "--all").split("\n"))
+    expected = { line[:40] for line in expected }
+
+    mygitlib.bitmap_write(repo, list(mygitlib.ref_list(repo).values()))
+
+    objects = mygitlib.reachable_objects(repo, [ tag ])
+    assert set(objects) == expected
+    assert objects[tag] == b'tag'
+    assert objects == mygitlib.reachable_objects(repo, [ tag ], mygitlib.GitBitmapIndex())
+
+
+def test_bitmap_tree_and_blob_tips(synthetic, git):
+
+    repo, head = synthetic
+
+    # Tags of a tree and of a blob, and a plain ref to an older tree: none
+    # of them reachable from a commit
+    blob = mygitlib.object_write(mygitlib.GitBlob(b"tagged\n"), repo)
+    old_tree = git(repo.worktree, "rev-parse", "HEAD~5^{tree}")
+
+    new_tree = mygitlib.GitTree()
+    new_tree.items.append(mygitlib.GitTreeLeaf(b"100644", "f", mygitlib.object_write(mygitlib.GitBlob(b"f\n"), repo)))
+    new_tree = mygitlib.object_write(new_tree, repo)
+
+    git(repo.worktree, "tag", "-a", "treetag", "-m", "A tree", old_tree)
+    git(repo.worktree, "tag", "-a", "blobtag", "-m", "A blob", blob)
+    git(repo.worktree, "update-ref", "refs/trees/empty", new_tree)
+
+    for name in [ "treetag", "blobtag", "refs/trees/empty" ]:
+
+        expected = git(repo.worktree, "rev-list", "--objects", name).split("\n")
+        expected = { line[:40] for line in expected }
+
+        objects = mygitlib.reachable_objects(repo, [ mygitlib.object_find(repo, name) ])
+        assert set(objects) == expected
+
+    tips = list(mygitlib.ref_list(repo).values())
+
+    expected = set(git(repo.worktree, "rev-list", "--objects", "--all").split("\n"))
+    expected = { line[:40] for line in expected }
+
+    # Indexed too, nothing is left out of the table
+    bitmap = mygitlib.bitmap_write(repo, tips)
+    assert set(bitmap.table) == expected
+
+    assert set(mygitlib.reachable_objects(repo, tips, mygitlib.bitmap_read(repo))) == expected
+    assert mygitlib.reachable_count(repo, tips, mygitlib.bitmap_read(repo)) == len(expected)
+
+
+def test_bitmap_only_query(synthetic):
+
+    repo, head = synthetic
+
+    mygitlib.bitmap_write(repo, [ head ])
+    bitmap = mygitlib.bitmap_read(repo)
+
+    # head has a bitmap, no need to map the table's SHAs to positions
+    assert mygitlib.reachable_count(repo, [ head ], bitmap) == len(bitmap.table)
+    assert bitmap._positions == None
+
+
+@pytest.mark.parametrize("with_bitmap", [ False, True ])
+def test_reachable_objects_newest_first(synthetic, with_bitmap):
+
+    repo, head = synthetic
+
+    if with_bitmap:
+        parent = mygitlib.commit_parents(mygitlib.object_read(repo, head))[0]
+        mygitlib.bitmap_write(repo, [ parent ], interval=7)
+
+    objects = list(mygitlib.reachable_objects(repo, [ head ]).items())
+    commits = [ sha for sha, fmt in objects if fmt == b'commit' ]
+
+    # Commits first, each one before its parents
+    assert [ fmt for sha, fmt in objects[:len(commits)] ] == [ b'commit' ] * len(commits)
+    assert commits[0] == head
+
+    index = { sha: i for i, sha in enumerate(commits) }
+
+    for sha in commits:
+        for parent in mygitlib.commit_parents(mygitlib.object_read(repo, sha)):
+            assert index[parent] > index[sha]
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import mygitlib
+from conftest import ROOT
+
+
+def test_main_rev_parse(tmp_path, git, monkeypatch, capsys):
+
+    path = str(tmp_path)
+    git(path, "init", "-q", ".")
+    git(path, "commit", "-q", "--allow-empty", "-m", "First")
+
+    monkeypatch.chdir(path)
+    mygitlib.main([ "rev-parse", "HEAD" ])
+
+    assert capsys.readouterr().out.strip() == git(path, "rev-parse", "HEAD")
+
+
+@pytest.mark.parametrize("argv", [ [ "--help" ], [ "no-such-command" ], [] ])
+def test_main_lists_every_command(argv, capsys):
+
+    # Only the command which runs is registered, except when argparse has
+    # to list them all
+    with pytest.raises(SystemExit):
+        mygitlib.main(argv)
+
+    out = capsys.readouterr()
+
+    for name in mygitlib.commands:
+        assert name in out.out + out.err
+
+
+def test_import_is_cheap():
+
+    check = "import sys, mygitlib; print(' '.join(sorted(sys.modules)))"
+
+    ret = subprocess.run([ sys.executable, "-c", check ], check=True, capture_output=True, text=True,
+                         env=dict({ k: v for k, v in os.environ.items() if not k.startswith("MYGIT_TRACE") },
+                                  PYTHONPATH=os.path.join(ROOT, "src")))
+
+    modules = set(ret.stdout.split())
+
+    assert "mygitlib" in modules
+    assert not modules & { "argparse", "configparser", "zlib", "hashlib", "datetime", "json", "threading" }
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import mygitlib
+
+
+@pytest.fixture
+def source(tmp_path, git):
+
+    path = str(tmp_path / "source")
+    os.makedirs(os.path.join(path, "d"))
+
+    git(path, "init", "-q", ".")
+
+    for name, data in [ ("x.c", "c\n"), ("d/f", "f\n"), ("run", "#!/bin/sh\n") ]:
+        with open(os.path.join(path, name), "w") as f:
+            f.write(data)
+
+    os.chmod(os.path.join(path, "run"), 0o755)
+    os.symlink("x.c", os.path.join(path, "x"))
+    os.symlink("../x.c", os.path.join(path, "d", "link"))
+
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "First")
+
+    # A submodule, whose commit isn't in this repository
+    git(path, "update-index", "--add", "--cacheinfo", "160000,{0},sub".format("c" * 40))
+    git(path, "commit", "-q", "-m", "Second")
+    git(path, "tag", "-a", "v1", "-m", "Version 1")
+
+    return path
+
+
+@pytest.mark.parametrize("shared", [ False, True ])
+def test_clone_clean(source, tmp_path, git, shared):
+
+    path = str(tmp_path / "clone")
+    repo = mygitlib.repo_clone(source, path, shared=shared)
+
+    assert git(path, "status", "--porcelain") == ""
+    assert git(path, "rev-parse", "HEAD") == git(source, "rev-parse", "HEAD")
+    assert git(path, "rev-parse", "v1") == git(source, "rev-parse", "v1")
+
+    assert os.readlink(os.path.join(path, "x")) == "x.c"
+    assert os.readlink(os.path.join(path, "d", "link")) == "../x.c"
+    assert os.access(os.path.join(path, "run"), os.X_OK)
+    assert not os.access(os.path.join(path, "x.c"), os.X_OK)
+
+    # Our own index matches the tree, without rewriting a thing
+    index = mygitlib.index_read(repo)
+    assert mygitlib.tree_from_index(repo, index) == git(path, "rev-parse", "HEAD^{tree}")
+
+    git(path, "fsck", "--no-dangling")
+
+
+def test_clone_not_empty(source, tmp_path):
+
+    path = tmp_path / "clone"
+    path.mkdir()
+    (path / "x.c").write_text("junk\n")
+
+    with pytest.raises(Exception, match="Not empty"):
+        mygitlib.repo_clone(source, str(path))
+
+    # Nothing written, not even .git
+    assert os.listdir(path) == [ "x.c" ]
+    assert (path / "x.c").read_text() == "junk\n"
+
+    (tmp_path / "file").write_text("junk\n")
+
+    with pytest.raises(Exception, match="Not a directory"):
+        mygitlib.repo_clone(source, str(tmp_path / "file"))
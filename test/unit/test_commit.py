@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import mygitlib
+
+
+@pytest.fixture
+def worktree(tmp_path, git, monkeypatch):
+
+    path = str(tmp_path)
+
+    git(path, "init", "-q", ".")
+    git(path, "config", "user.name", "Test")
+    git(path, "config", "user.email", "test@example.com")
+
+    with open(os.path.join(path, "a"), "w") as f:
+        f.write("a\n")
+
+    git(path, "add", "a")
+    monkeypatch.chdir(path)
+
+    return path
+
+
+def test_commit(worktree, git, capsys):
+
+    mygitlib.main([ "commit", "-m", "First" ])
+    first = capsys.readouterr().out.strip()
+
+    assert git(worktree, "rev-parse", "HEAD") == first
+    assert git(worktree, "status", "--porcelain") == ""
+
+    with open(os.path.join(worktree, "a"), "w") as f:
+        f.write("b\n")
+
+    git(worktree, "add", "a")
+    mygitlib.main([ "commit", "-m", "Second" ])
+
+    assert git(worktree, "rev-parse", "HEAD^") == first
+
+
+def test_commit_nothing_staged(worktree, git, capsys):
+
+    mygitlib.main([ "commit", "-m", "First" ])
+    head = git(worktree, "rev-parse", "HEAD")
+
+    with pytest.raises(Exception, match="Nothing to commit"):
+        mygitlib.main([ "commit", "-m", "Empty" ])
+
+    assert git(worktree, "rev-parse", "HEAD") == head
@@ -0,0 +1,81 @@
+import os
+
+import mygitlib
+
+
+def make_repo(path, git):
+
+    git(path, "init", "-q", ".")
+
+    # A symlink next to a file sharing its prefix, a directory next to
+    # files sharing its prefix, an executable and a few levels of nesting
+    os.makedirs(os.path.join(path, "d", "e"))
+    os.makedirs(os.path.join(path, "x.d"))
+
+    for name, data in [ ("x.c", "c\n"), ("d.c", "d\n"), ("d0", "0\n"), ("d/f", "f\n"),
+                        ("d/e/g", "g\n"), ("x.d/h", "h\n"), ("run", "#!/bin/sh\n") ]:
+        with open(os.path.join(path, name), "w") as f:
+            f.write(data)
+
+    os.chmod(os.path.join(path, "run"), 0o755)
+    os.symlink("x.c", os.path.join(path, "x"))
+    os.symlink("f", os.path.join(path, "d", "link"))
+
+    git(path, "add", ".")
+
+    return mygitlib.repo_find(path)
+
+
+def test_tree_from_index_matches_git(tmp_path, git):
+
+    repo = make_repo(str(tmp_path), git)
+    index = mygitlib.index_read(repo)
+
+    assert mygitlib.tree_from_index(repo, index) == git(tmp_path, "write-tree")
+
+
+def test_index_round_trip(tmp_path, git):
+
+    repo = make_repo(str(tmp_path), git)
+
+    # git writes the TREE extension on write-tree
+    git(tmp_path, "write-tree")
+
+    with open(os.path.join(repo.gitdir, "index"), "rb") as f:
+        raw = f.read()
+
+    index = mygitlib.index_read(repo)
+    assert index.cache_tree.sha == git(tmp_path, "write-tree")
+    assert index.cache_tree.subtrees["d"].entry_count == 3
+
+    mygitlib.index_write(repo, index)
+
+    with open(os.path.join(repo.gitdir, "index"), "rb") as f:
+        assert f.read() == raw
+
+
+def test_cache_tree_invalidate(tmp_path, git):
+
+    repo = make_repo(str(tmp_path), git)
+    index = mygitlib.index_read(repo)
+    mygitlib.tree_from_index(repo, index)
+
+    with open(os.path.join(tmp_path, "d", "e", "g"), "w") as f:
+        f.write("changed\n")
+
+    git(tmp_path, "add", "d/e/g")
+    expected = git(tmp_path, "write-tree")
+
+    # Same change on our side, but invalidated by us: only the ancestors
+    # of d/e/g lose their cached tree
+    entry = [ e for e in index.entries if e.name == "d/e/g" ][0]
+    entry.sha = git(tmp_path, "rev-parse", ":d/e/g")
+
+    mygitlib.cache_tree_invalidate(index, entry.name)
+
+    assert index.cache_tree.sha == None
+    assert index.cache_tree.subtrees["d"].sha == None
+    assert index.cache_tree.subtrees["d"].subtrees["e"].sha == None
+    assert index.cache_tree.subtrees["x.d"].sha != None
+
+    assert mygitlib.tree_from_index(repo, index) == expected
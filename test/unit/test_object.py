@@ -0,0 +1,25 @@
+import mygitlib
+
+
+def test_object_cache_per_repository(tmp_path):
+
+    a = mygitlib.GitRepository(mygitlib.repo_create(str(tmp_path / "a")).worktree)
+    b = mygitlib.GitRepository(mygitlib.repo_create(str(tmp_path / "b")).worktree)
+
+    sha = mygitlib.object_write(mygitlib.GitBlob(b"only in a\n"), a)
+
+    assert mygitlib.object_read(a, sha).blobdata == b"only in a\n"
+
+    # Cached by a, still missing from b
+    assert mygitlib.object_read(b, sha) == None
+
+
+def test_object_cache_alternates(tmp_path):
+
+    src = mygitlib.GitRepository(mygitlib.repo_create(str(tmp_path / "src")).worktree)
+    sha = mygitlib.object_write(mygitlib.GitBlob(b"shared\n"), src)
+
+    clone = mygitlib.repo_clone(src.worktree, str(tmp_path / "clone"), shared=True)
+
+    assert mygitlib.object_read(clone, sha).blobdata == b"shared\n"
+    assert mygitlib.object_read(src, sha).blobdata == b"shared\n"
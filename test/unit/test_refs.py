@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import mygitlib
+
+A = "a" * 40
+B = "b" * 40
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return mygitlib.GitRepository(mygitlib.repo_create(str(tmp_path)).worktree)
+
+
+def test_ref_write_old(repo):
+
+    mygitlib.ref_write(repo, "refs/heads/master", A, old=None)
+    assert mygitlib.ref_resolve(repo, "refs/heads/master") == A
+
+    # Someone else moved the branch since we read it
+    with pytest.raises(Exception, match="expected"):
+        mygitlib.ref_write(repo, "refs/heads/master", B, old=None)
+
+    mygitlib.ref_write(repo, "refs/heads/master", B, old=A)
+    assert mygitlib.ref_resolve(repo, "refs/heads/master") == B
+
+    with pytest.raises(Exception, match="expected"):
+        mygitlib.ref_write(repo, "refs/heads/master", A, old=A)
+
+    assert mygitlib.ref_resolve(repo, "refs/heads/master") == B
+    assert not os.path.exists(mygitlib.repo_file(repo, "refs", "heads", "master.lock"))
+
+
+def test_ref_write_locked(repo):
+
+    mygitlib.ref_write(repo, "refs/heads/master", A)
+
+    lock = mygitlib.repo_file(repo, "refs", "heads", "master.lock")
+
+    with open(lock, "w") as f:
+        f.write(B + "\n")
+
+    with pytest.raises(Exception, match="lock"):
+        mygitlib.ref_write(repo, "refs/heads/master", B)
+
+    # The lock belongs to whoever created it
+    assert os.path.exists(lock)
+    assert mygitlib.ref_resolve(repo, "refs/heads/master") == A
@@ -0,0 +1,125 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+MYGIT = os.path.join(ROOT, "src", "bin", "mygit")
+
+
+def mygit(cwd, *args, **env):
+    """Run the mygit command in a new process, tracing is set up on import."""
+
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"), **env)
+
+    for name in [ "MYGIT_TRACE", "MYGIT_TRACE_FORMAT" ]:
+        if env.get(name) == None:
+            env.pop(name, None)
+
+    return subprocess.run([ sys.executable, MYGIT, *args ], cwd=cwd, env=env, check=True, capture_output=True, text=True)
+
+
+@pytest.fixture
+def worktree(tmp_path, git):
+
+    path = str(tmp_path / "repo")
+    os.makedirs(path)
+
+    git(path, "init", "-q", ".")
+
+    with open(os.path.join(path, "a"), "w") as f:
+        f.write("a\n")
+
+    git(path, "add", "a")
+    git(path, "commit", "-q", "-m", "First")
+
+    return path
+
+
+def test_trace_relative_path(worktree):
+
+    ret = mygit(worktree, "rev-parse", "HEAD", MYGIT_TRACE="on")
+
+    # Not taken as a file in the worktree
+    assert sorted(os.listdir(worktree)) == [ ".git", "a" ]
+    assert "MYGIT_TRACE" in ret.stderr
+
+
+def test_trace_jsonl(worktree, tmp_path):
+
+    dest = str(tmp_path / "trace.jsonl")
+
+    for i in range(2):
+        mygit(worktree, "rev-list", "--objects", "HEAD", MYGIT_TRACE=dest)
+
+    with open(dest) as f:
+        events = [ json.loads(line) for line in f ]
+
+    # Appended: both runs are there
+    counters = [ e["counters"] for e in events if e["event"] == "counters" ]
+    spans = { e["name"] for e in events if e["event"] == "span" }
+
+    assert len(counters) == 2
+    assert { "cmd_rev_list", "repo_find", "object_read" } <= spans
+
+    # The commit and its tree, the blob only needs its SHA
+    assert counters[0]["objects_read"] == 2
+    assert counters[0]["bytes_inflated"] > 0
+    assert counters[0]["syscall.open"] > 0
+
+
+def test_trace_chrome(worktree, tmp_path):
+
+    dest = str(tmp_path / "trace.json")
+
+    for i in range(2):
+        mygit(worktree, "rev-list", "HEAD", MYGIT_TRACE=dest, MYGIT_TRACE_FORMAT="chrome")
+
+    # Still a single JSON document, the last run's
+    with open(dest) as f:
+        trace = json.load(f)
+
+    names = [ e["name"] for e in trace["traceEvents"] ]
+
+    assert names.count("cmd_rev_list") == 1
+    assert names.count("counters") == 1
+    assert trace["traceEvents"][-1]["args"]["objects_read"] >= 1
+
+
+def test_trace_off(worktree):
+
+    check = "import mygitlib; print(hasattr(mygitlib.object_read, '__wrapped__'), mygitlib.trace_counters)"
+
+    ret = subprocess.run([ sys.executable, "-c", check ], cwd=worktree, check=True, capture_output=True, text=True,
+                         env=dict({ k: v for k, v in os.environ.items() if not k.startswith("MYGIT_TRACE") },
+                                  PYTHONPATH=os.path.join(ROOT, "src")))
+
+    # Nothing wrapped, nothing recorded
+    assert ret.stdout.split() == [ "False", "None" ]
+
+    ret = mygit(worktree, "rev-parse", "HEAD")
+    assert ret.stderr == ""
+
+
+def test_trace_counters_threads(worktree, tmp_path):
+
+    check = """
+import threading, mygitlib
+
+def count():
+    for i in range(20000):
+        mygitlib.trace_count("test")
+
+threads = [ threading.Thread(target=count) for i in range(8) ]
+[ t.start() for t in threads ]
+[ t.join() for t in threads ]
+print(mygitlib.trace_counters["test"])
+"""
+
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"), MYGIT_TRACE=str(tmp_path / "trace.jsonl"))
+    ret = subprocess.run([ sys.executable, "-c", check ], cwd=worktree, env=env, check=True, capture_output=True, text=True)
+
+    assert ret.stdout.strip() == str(8 * 20000)